@@ -0,0 +1,147 @@
+"""
+Throughput benchmark for the forcing and discharge repositories on synthetic data.
+
+Every case runs in a fresh process so that the reported peak RSS belongs to that
+case alone. Example, 10 000 stations and 30 years of hourly data:
+
+    python -m mst_himalaya.benchmark_repositories --data-dir /tmp/bench --stations 10000 --steps 262980
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+from os import path
+import resource
+import time
+
+from mst_himalaya.synthetic_data import EPSG, FORCING_FILES, write_forcing_files, write_discharge_file
+
+T0 = 946684800  # 2000-01-01T00:00:00Z, start of the synthetic files
+
+SHYFT_TYPES = {"temperature": "temperature", "precipitation": "precipitation", "wind_speed": "wind_speed",
+               "relative_humidity": "relative_humidity", "global_radiation": "radiation"}
+
+
+def _geo_ts_points(geo_ts):
+    return sum(len(v)*(v[0].ts.size() if len(v) else 0) for v in geo_ts.values())
+
+
+def _case_cf_data_repos(data_dir, period, block, dtype):
+    from mst_himalaya.wfde5_cf_geo_ts_repository import CFDataRepos
+    points = 0
+    for name, f in FORCING_FILES.items():
+        repo = CFDataRepos(EPSG, path.join(data_dir, f), padding=0., dtype=dtype)
+        points += _geo_ts_points(repo.get_timeseries([SHYFT_TYPES[name]], period))
+    return points
+
+
+def _case_cf_multi_data_repos(data_dir, period, block, dtype):
+    from mst_himalaya.wfde5_cf_geo_ts_repository import CFMultiDataRepos
+    repo = CFMultiDataRepos(EPSG, [path.join(data_dir, f) for f in FORCING_FILES.values()], padding=0., dtype=dtype)
+    return _geo_ts_points(repo.get_timeseries(list(SHYFT_TYPES.values()), period))
+
+
+def _case_cf_multi_data_repos_iter(data_dir, period, block, dtype):
+    from mst_himalaya.wfde5_cf_geo_ts_repository import CFMultiDataRepos
+    repo = CFMultiDataRepos(EPSG, [path.join(data_dir, f) for f in FORCING_FILES.values()], padding=0., dtype=dtype)
+    return sum(_geo_ts_points(geo_ts) for _, geo_ts in
+               repo.iter_timeseries(list(SHYFT_TYPES.values()), period, block=block))
+
+
+def _case_memmap_data_repos(data_dir, period, block, dtype):
+    from mst_himalaya.memmap_forcing_repository import MemmapDataRepos
+    repo = MemmapDataRepos(EPSG, path.join(data_dir, "memmap"), padding=0., dtype=dtype)
+    return _geo_ts_points(repo.get_timeseries(list(SHYFT_TYPES.values()), period))
+
+
+def _case_cf_ts_repository(data_dir, period, block, dtype):
+    from netCDF4 import Dataset
+    from mst_himalaya.wfde5_cf_ts_repository import CFTsRepository
+    filename = path.join(data_dir, "discharge.nc")
+    with Dataset(filename) as ds:
+        names = list(ds.variables["series_name"][:])
+    tsv = CFTsRepository(filename, "discharge").read(names, period)
+    return sum(ts.size() for ts in tsv.values())
+
+
+CASES = {"CFDataRepos.get_timeseries": _case_cf_data_repos,
+         "CFMultiDataRepos.get_timeseries": _case_cf_multi_data_repos,
+         "CFMultiDataRepos.iter_timeseries": _case_cf_multi_data_repos_iter,
+         "MemmapDataRepos.get_timeseries": _case_memmap_data_repos,
+         "CFTsRepository.read": _case_cf_ts_repository}
+
+
+def _run_case(name, data_dir, start, end, block, dtype, queue):
+    from shyft.time_series import UtcPeriod
+    t = time.perf_counter()
+    points = CASES[name](data_dir, UtcPeriod(start, end), block, dtype)
+    elapsed = time.perf_counter() - t
+    # ru_maxrss is in kilobytes on linux
+    queue.put({"case": name, "seconds": elapsed, "points": points,
+               "points_per_second": points/elapsed if elapsed > 0 else float("nan"),
+               "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.})
+
+
+def prepare(data_dir, n_stations, n_steps, dt_hours=1, chunks=None, n_gauges=10):
+    """Write the synthetic forcing, discharge and memmap store used by the cases."""
+    from mst_himalaya.memmap_forcing_repository import convert_to_memmap
+    files = write_forcing_files(data_dir, n_stations=n_stations, n_steps=n_steps, dt_hours=dt_hours, chunks=chunks)
+    write_discharge_file(path.join(data_dir, "discharge.nc"), n_series=n_gauges,
+                         n_steps=max(n_steps*dt_hours//24, 2), dt_hours=24)
+    convert_to_memmap(list(files.values()), path.join(data_dir, "memmap"))
+
+
+def run(data_dir, n_steps, dt_hours=1, cases=None, block=365*86400, dtype="float64"):
+    """
+    Run the cases on prepared data, each in its own process, and return their results.
+
+    dtype is the read dtype of the forcing repositories, compare the peak RSS of
+    float32 and float64 runs to see what the narrower buffers save.
+    """
+    ctx = mp.get_context("spawn")
+    results = []
+    for name in cases or list(CASES):
+        end = T0 + (n_steps - 1)*dt_hours*3600
+        if name == "CFTsRepository.read":
+            end = T0 + (max(n_steps*dt_hours//24, 2) - 1)*86400
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_run_case, args=(name, data_dir, T0, end, block, dtype, queue))
+        proc.start()
+        proc.join()
+        if proc.exitcode != 0:
+            results.append({"case": name, "error": "exit code {}".format(proc.exitcode)})
+        else:
+            results.append(queue.get())
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", required=True, help="where the synthetic files are written")
+    parser.add_argument("--stations", type=int, default=1000)
+    parser.add_argument("--steps", type=int, default=8760)
+    parser.add_argument("--dt-hours", type=int, default=1)
+    parser.add_argument("--chunks", type=int, nargs=2, default=None, metavar=("TIME", "STATION"))
+    parser.add_argument("--dtype", choices=["float64", "float32"], default="float64",
+                        help="read dtype of the forcing repositories")
+    parser.add_argument("--case", action="append", choices=list(CASES), help="run only these cases")
+    parser.add_argument("--skip-prepare", action="store_true", help="reuse files from an earlier run")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    if not args.skip_prepare:
+        prepare(args.data_dir, args.stations, args.steps, args.dt_hours, tuple(args.chunks) if args.chunks else None)
+    results = run(args.data_dir, args.steps, args.dt_hours, args.case, dtype=args.dtype)
+    print("{:<36} {:>10} {:>14} {:>16} {:>12}".format("case", "seconds", "points", "points/s", "peak RSS MB"))
+    for r in results:
+        if "error" in r:
+            print("{:<36} {}".format(r["case"], r["error"]))
+        else:
+            print("{case:<36} {seconds:>10.3f} {points:>14d} {points_per_second:>16.0f} {peak_rss_mb:>12.1f}".format(**r))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
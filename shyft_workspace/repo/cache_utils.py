@@ -0,0 +1,137 @@
+"""
+Building blocks shared by the caches of this package: a thread safe LRU mapping,
+atomic writes of cache files and content hashes of source files.
+
+Kept free of shyft and of the repositories, so geometry, TIN and calibration
+code can all depend on it.
+"""
+
+from collections import OrderedDict
+import hashlib
+from os import getpid, path, makedirs, replace
+import threading
+
+
+class LRUCache:
+    """
+    Thread safe mapping keeping the max_size most recently used entries.
+
+    on_evict(key, value) is called for every entry dropped by eviction, discard
+    or clear, with the cache lock held, so it must not call back into the cache.
+    """
+
+    def __init__(self, max_size, on_evict=None):
+        self._max_size = max_size
+        self._on_evict = on_evict
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    @max_size.setter
+    def max_size(self, value):
+        with self._lock:
+            self._max_size = value
+            self._evict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+    def get(self, key, default=None):
+        """Value of key, marked as most recently used, or default."""
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._evict()
+        return value
+
+    def get_or_compute(self, key, compute):
+        """
+        Value of key, calling compute() on a miss. compute runs without the lock
+        held, so concurrent misses may compute the same value, the first stored wins.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        value = compute()
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self._entries[key] = value
+            self._evict()
+        return value
+
+    def discard(self, key):
+        with self._lock:
+            self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._drop(key)
+
+    def _drop(self, key):
+        value = self._entries.pop(key, None)
+        if value is not None and self._on_evict is not None:
+            self._on_evict(key, value)
+
+    def _evict(self):
+        while len(self._entries) > self._max_size:
+            self._drop(next(iter(self._entries)))
+
+
+def key_digest(key):
+    """sha1 hex digest of repr(key), names cache files after a cache key."""
+    return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+
+
+def atomic_write(filename, write):
+    """
+    Create filename by calling write(tmp) on a temporary name in the same directory
+    and renaming it, so concurrent processes never see partial files.
+
+    The temporary name keeps the extension of filename, as np.save and np.savez
+    append theirs otherwise.
+    """
+    directory = path.dirname(filename)
+    if directory:
+        makedirs(directory, exist_ok=True)
+    root, ext = path.splitext(filename)
+    tmp = "{}.{}.{}.tmp{}".format(root, getpid(), threading.get_ident(), ext)
+    write(tmp)
+    replace(tmp, filename)
+    return filename
+
+
+# (filename, size, mtime) -> sha1 of the file content, bounded as regenerated files add keys
+_file_hashes = LRUCache(1024)
+
+
+def _sha1_of_file(filename):
+    sha1 = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def file_hash(filename):
+    """sha1 of the content of filename, memoized while size and mtime are unchanged."""
+    filename = path.abspath(filename)
+    key = filename, path.getsize(filename), path.getmtime(filename)
+    return _file_hashes.get_or_compute(key, lambda: _sha1_of_file(filename))
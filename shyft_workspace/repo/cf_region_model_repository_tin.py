@@ -5,36 +5,246 @@ Read region rasputin files with cell data.
 
 """
 
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from os import path
+import threading
 import numpy as np
 from netCDF4 import Dataset
 from shyft.hydrology.repository import interfaces
 from pathlib import Path
 from typing import Union
-import pyproj
-from functools import partial
+import shapely
+from shapely import STRtree
 from shapely.geometry import Polygon, MultiPolygon, box
-from shapely.ops import transform
 
 from shyft.hydrology import shyftdata_dir
-from shyft.hydrology.orchestration.configuration.config_interfaces import RegionConfig, ModelConfig,>
-from shyft.hydrology.orchestration.configuration.dict_configs import DictModelConfig, DictRegionConf>
-from shyft.hydrology.repository.netcdf.utils import create_ncfile, make_proj
-
-def get_land_type(rgb, land_covers_available)->(int,str):
-    for (v,n,r,g,b) in land_covers_available:
-        rgbs = (r,g, b)
-        (value,name) = (v,n)
-        if rgb == rgbs:
-            return (value,name)
-        else:
-            pass
+from shyft.hydrology.orchestration.configuration.config_interfaces import RegionConfig, ModelConfig, RegionConfigError
+from shyft.hydrology.orchestration.configuration.dict_configs import DictModelConfig, DictRegionConfig
+from mst_himalaya.land_cover import LandCoverClassifier
+from mst_himalaya.geometry_cache import geometry_key, load_geometry, save_geometry
+from mst_himalaya.proj_registry import transform as transform_xy, transform_geometry
+from mst_himalaya.parameter_template import parameter_template
+from mst_himalaya.tin_decimation import DECIMATION_VERSION, DecimatedTinCache, decimate, decimated_tin_cache
 
 
 class CFRegionModelRepositoryError(Exception):
     pass
 
 
+def pack_rgb(rgb):
+    """Pack colours (..., 3) with components in [0, 1] into integers r << 16 | g << 8 | b."""
+    c = np.round(np.asarray(rgb, dtype=np.float64)*255).astype(np.int64)
+    return (c[..., 0] << 16) | (c[..., 1] << 8) | c[..., 2]
+
+
+def land_cover_index(cover_color, land_covers):
+    """
+    Index into land_covers of the entry with the colour of each face.
+
+    Parameters
+    ----------
+    cover_color: np.ndarray
+        (n_faces, 3) face colours with components in [0, 1]
+    land_covers: sequence
+        rows of (value, name, red, green, blue), colour components in 0..255
+    """
+    table = np.array([(int(r) << 16) | (int(g) << 8) | int(b) for (_, _, r, g, b) in land_covers], dtype=np.int64)
+    keys, first = np.unique(table, return_index=True)  # first match wins for repeated colours
+    packed = pack_rgb(cover_color)
+    pos = np.minimum(np.searchsorted(keys, packed), len(keys) - 1)
+    unknown = keys[pos] != packed
+    if np.any(unknown):
+        raise CFRegionModelRepositoryError("No land cover with colour {:06x}".format(int(packed[unknown][0])))
+    return first[pos]
+
+
+class TinReader:
+    """
+    Context managed reader of a rasputin TIN file.
+
+    Faces and face fields are read in chunks of chunk_size rows, together with the
+    points those faces use, and the face corner coordinates are gathered straight
+    into one preallocated output array, so peak memory stays close to the size of
+    the result also for the largest TINs. points() and faces() read whole datasets,
+    for decimation, which works on the full mesh.
+    """
+
+    def __init__(self, filename, chunk_size=65536):
+        self._filename = filename
+        self._chunk_size = chunk_size
+        self._file = None
+
+    def __enter__(self):
+        # instead of rasputin we use pip available h5py to parse h5 files
+        import h5py
+        self._file = h5py.File(self._filename, 'r')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._file.close()
+        self._file = None
+
+    @property
+    def _tin(self):
+        if self._file is None:
+            raise CFRegionModelRepositoryError("TinReader of '{}' used outside its with block".format(self._filename))
+        # in the rasputin generated tins main groups are "information" and "tin"
+        return self._file["tin"]
+
+    @property
+    def n_faces(self):
+        return self._tin["faces"].shape[0]
+
+    def _chunks(self):
+        for start in range(0, self.n_faces, self._chunk_size):
+            yield slice(start, min(start + self._chunk_size, self.n_faces))
+
+    def points(self):
+        """(n_points, 3) vertex coordinates."""
+        return self._tin["points"][()]
+
+    def faces(self):
+        """(n_faces, 3) vertex indices of each face."""
+        return self._tin["faces"][()]
+
+    def vertices(self, out=None):
+        """
+        (n_faces, 3, 3) corner coordinates of each face, written into out when given.
+        """
+        points = self._tin["points"]  # (L, 3), L -- number of vertexes
+        if out is None:
+            out = np.empty((self.n_faces, 3, 3), dtype=points.dtype)
+        faces = self._tin["faces"]
+        for s in self._chunks():
+            f = faces[s]
+            used = np.unique(f)
+            lo, hi = int(used[0]), int(used[-1]) + 1
+            if hi - lo <= 2*len(used):
+                # faces of a chunk mostly use nearby points, one slab read is cheapest
+                np.take(points[lo:hi], f - lo, axis=0, out=out[s])
+            else:
+                np.take(points[used], np.searchsorted(used, f), axis=0, out=out[s])
+        return out
+
+    def cover_type(self, out=None):
+        """Land cover code of each face, written into out when given."""
+        face_fields = self._tin["face_fields"]
+        if out is None:
+            out = np.empty(self.n_faces, dtype=np.int64)
+        if "cover_type" in face_fields:
+            cover_type = face_fields["cover_type"]
+            for s in self._chunks():
+                out[s] = cover_type[s]
+        else:
+            # older files only carry the colour, the code is looked up in the land cover table
+            land_covers = self._file["information"]["land_covers"][()]
+            values = np.array([v for (v, _, _, _, _) in land_covers])
+            cover_color = face_fields["cover_color"]
+            for s in self._chunks():
+                out[s] = values[land_cover_index(cover_color[s], land_covers)]
+        return out
+
+
+def read_tin_mesh(filename):
+    """
+    Read a rasputin TIN file as a mesh.
+
+    Returns
+    -------
+    points: np.ndarray
+        (n_points, 3) vertex coordinates
+    faces: np.ndarray
+        (n_faces, 3) vertex indices of each face
+    cover_type: np.ndarray
+        land cover code of each face
+    """
+    with TinReader(filename) as tin:
+        return tin.points(), tin.faces(), tin.cover_type()
+
+
+def read_tin(filename, target_faces=None, tolerance=None, max_area_change=0.02, cache_dir=None):
+    """
+    Read a rasputin TIN file, decimated when target_faces or tolerance is given.
+
+    Undecimated files are read chunk by chunk through TinReader. Decimation needs
+    the whole mesh in memory, so that path reads the full file.
+
+    Parameters
+    ----------
+    filename: str
+        TIN file
+    target_faces: int, optional
+        face budget of the decimated mesh
+    tolerance: float, optional
+        largest vertical distance of an original vertex from the decimated surface
+    max_area_change: float
+        largest relative change of the area of any land cover in decimation
+    cache_dir: str, optional
+        directory keeping decimated meshes between runs
+
+    Returns
+    -------
+    vertices: np.ndarray
+        (n_faces, 3, 3) corner coordinates of each face
+    cover_type: np.ndarray
+        land cover code of each face
+    """
+    if target_faces is None and tolerance is None:
+        with TinReader(filename) as tin:
+            return tin.vertices(), tin.cover_type()
+    points, faces, cover_type = decimated_tin_cache.get_or_compute(
+        DecimatedTinCache.make_key(filename, target_faces, tolerance, max_area_change),
+        lambda: decimate(*read_tin_mesh(filename), target_faces=target_faces, tolerance=tolerance,
+                         max_area_change=max_area_change),
+        cache_dir)
+    return points[faces], cover_type
+
+
+def faces_in_polygon(vertices, polygon):
+    """
+    Mask of the faces (n_faces, 3, 3) overlapping polygon.
+
+    Candidates come from an STRtree over the face bounding boxes and only those are
+    tested exactly. Needs the vectorized geometry functions of Shapely 2.
+    """
+    xy = vertices[:, :, :2]
+    lower, upper = xy.min(axis=1), xy.max(axis=1)
+    tree = STRtree(shapely.box(lower[:, 0], lower[:, 1], upper[:, 0], upper[:, 1]))
+    candidates = tree.query(polygon, predicate="intersects")
+    mask = np.zeros(len(vertices), dtype=bool)
+    if len(candidates):
+        mask[candidates[shapely.intersects(shapely.polygons(xy[candidates]), polygon)]] = True
+    return mask
+
+
+def _tin_catchment_id(tin_uid):
+    # cid = tin_uid = filename --> key to find subcatchment
+    return int(''.join(filter(str.isdigit, tin_uid)))
+
+
+class CatchmentIndex:
+    """
+    Cells grouped by catchment with catchment_id -> (start, stop) row ranges.
+    """
+
+    def __init__(self, cell_geo_data):
+        c_ids = cell_geo_data[:, 10]
+        if len(c_ids) > 1 and np.any(c_ids[1:] < c_ids[:-1]):
+            # stable, so cells keep their order within a catchment
+            cell_geo_data = cell_geo_data[np.argsort(c_ids, kind="stable")]
+        self.cells = cell_geo_data
+        ids, starts, counts = np.unique(self.cells[:, 10], return_index=True, return_counts=True)
+        self.ranges = {int(cid): (int(start), int(start + n)) for cid, start, n in zip(ids, starts, counts)}
+
+    def select(self, catchments):
+        """cell_geo_data rows of catchments, in catchment id order."""
+        ranges = sorted(self.ranges[int(cid)] for cid in catchments)
+        if len(ranges) == 1 or all(a[1] == b[0] for a, b in zip(ranges[:-1], ranges[1:])):
+            return self.cells[ranges[0][0]:ranges[-1][1]]
+        return np.concatenate([self.cells[start:stop] for start, stop in ranges])
+
+
 class CFRegionModelRepository(interfaces.RegionModelRepository):
     """
     Repository that delivers fully specified shyft api region_models
@@ -70,7 +280,6 @@ class CFRegionModelRepository(interfaces.RegionModelRepository):
         self._rconf = region_config
         self._mconf = model_config
         self._region_model = model_config.model_type()  # region_model
-        self._mask = None
         self._epsg = self._rconf.domain()["EPSG"]  # epsg
         self._tin_uid_ = self._rconf.repository()["params"]["tin_uid"]
         filename = self._rconf.repository()["params"]["data_file"]
@@ -91,20 +300,44 @@ class CFRegionModelRepository(interfaces.RegionModelRepository):
         self._tin_data_folder = tinfolder
         self._catch_ids = self._rconf.catchments()
         self._get_from_tin_ = self._rconf.repository()["params"]["get_model_from_tin_repo"]
+        # cover_type -> land type fractions, GlobCover unless the region config names another table
+        self._land_cover = LandCoverClassifier.from_yaml(self._rconf.repository()["params"].get("land_cover_file", None),
+                                                         self._rconf.repository()["params"].get("land_cover_table", "globcover"))
+        # TIN files are read in a thread pool, which shares decimated_tin_cache with later calls. tin_executor
+        # "process" reads them in worker processes instead and "sequential" one after the other in this thread
+        self._tin_max_workers = self._rconf.repository()["params"].get("tin_max_workers", None)
+        # tin_processes is the older name of tin_executor="process"
+        legacy = "process" if self._rconf.repository()["params"].get("tin_processes", False) else "thread"
+        self._tin_executor = self._rconf.repository()["params"].get("tin_executor", legacy)
+        if self._tin_executor not in ("process", "thread", "sequential"):
+            raise CFRegionModelRepositoryError("tin_executor must be 'process', 'thread' or 'sequential', got '{}'".format(
+                self._tin_executor))
+        # directory of compiled cell geometry shared between processes, no caching when None
+        cache_dir = self._rconf.repository()["params"].get("geometry_cache_dir", None)
+        if cache_dir is not None:
+            cache_dir = path.expandvars(cache_dir)
+            if not path.isabs(cache_dir):
+                cache_dir = path.join(shyftdata_dir, cache_dir)
+        self._geometry_cache_dir = cache_dir
+        # optional decimation of the TIN files to a face budget per file and/or a vertical tolerance in metres,
+        # moving no more than tin_max_area_change of the area of any land cover
+        self._tin_target_faces = self._rconf.repository()["params"].get("tin_target_faces", None)
+        self._tin_tolerance = self._rconf.repository()["params"].get("tin_tolerance", None)
+        self._tin_max_area_change = self._rconf.repository()["params"].get("tin_max_area_change", 0.02)
         self.bounding_box = None
+        # geometry of all configured catchments and its per catchment index, built on first use
+        self._geometry = None
+        self._catchment_index = None
+        self._geometry_lock = threading.Lock()
 
     def _limit(self, x, y, data_cs, target_cs):
         """
         Parameters
         ----------
         """
-        # Get coordinate system for arome data
-        data_proj = make_proj(data_cs)
-        target_proj = make_proj(target_cs)
-
         # Find bounding box in arome projection
         bbox = self.bounding_box
-        bb_proj = pyproj.transform(target_proj, data_proj, bbox[0], bbox[1])
+        bb_proj = transform_xy(target_cs, data_cs, bbox[0], bbox[1])
         x_min, x_max = min(bb_proj[0]), max(bb_proj[0])
         y_min, y_max = min(bb_proj[1]), max(bb_proj[1])
 
@@ -114,7 +347,7 @@ class CFRegionModelRepository(interfaces.RegionModelRepository):
         xy_inds = np.nonzero(xy_mask)[0]
 
         # Transform from source coordinates to target coordinates
-        xx, yy = pyproj.transform(data_proj, target_proj, x, y)
+        xx, yy = transform_xy(data_cs, target_cs, x, y)
 
         return xx, yy, xy_mask, xy_inds
 
@@ -136,6 +369,89 @@ class CFRegionModelRepository(interfaces.RegionModelRepository):
         region_model: shyft.api type
         """
 
+        cell_geo_data, c_ids_unique, bounding_region = self._cell_geo_data(catchments)
+
+        # Construct region parameter:
+        template = parameter_template(self._region_model)
+        region_parameter = template.create(self._mconf.model_parameters())
+
+        cell_vector = self._region_model.cell_t.vector_t.create_from_geo_cell_data_vector_to_tin(np.ravel(cell_geo_data))
+
+        # Construct catchment overrides
+        catchment_parameters = self._region_model.parameter_t.map_t()
+        region_values = template.values(region_parameter)
+        for cid, catch_param in self._rconf.parameter_overrides().items():
+            if cid in c_ids_unique:
+                catchment_parameters[cid] = template.create(catch_param, region_parameter, region_values, catchment=True)
+        region_model = self._region_model(cell_vector, region_parameter, catchment_parameters)
+        region_model.bounding_region = bounding_region
+        region_model.catchment_id_map = c_ids_unique
+        def do_clone(x):
+            clone = x.__class__(x)
+            clone.bounding_region = x.bounding_region
+            clone.catchment_id_map = x.catchment_id_map
+            # clone.gis_info = polygons  # cell shapes not included yet
+            return clone
+
+        region_model.clone = do_clone
+        return region_model
+
+    def _cell_geo_data(self, catchments=None):
+        """
+        The 15 column cell_geo_data array, the unique catchment ids and the bounding
+        region for catchments, all configured catchments when None.
+
+        The geometry of the configured catchments is kept in memory and sub-regions
+        are sliced from it through a catchment_id -> row range index.
+        """
+        with self._geometry_lock:
+            if self._geometry is None:
+                self._geometry = self._load_cell_geo_data()
+            cell_geo_data, c_ids_unique, bounding_region = self._geometry
+            if catchments is None:
+                return cell_geo_data, c_ids_unique, bounding_region
+            if self._catchment_index is None:
+                self._catchment_index = CatchmentIndex(cell_geo_data)
+        index = self._catchment_index
+        wanted = set(int(c) for c in catchments)
+        missing = wanted - set(index.ranges)
+        if missing:
+            raise CFRegionModelRepositoryError("Catchments {} not in the region, available are {}".format(
+                sorted(missing), sorted(index.ranges)))
+        return index.select(wanted), [cid for cid in c_ids_unique if int(cid) in wanted], bounding_region
+
+    def _load_cell_geo_data(self):
+        """
+        The 15 column cell_geo_data array, the unique catchment ids and the bounding
+        region, taken from the geometry cache when the region config names one.
+        """
+        key = None
+        if self._geometry_cache_dir is not None:
+            sources = [self._data_file] if not self._get_from_tin_ else \
+                [self._tin_data_folder + "/" + tid + ".h5" for tid in self._tin_uid_]
+            key = geometry_key(sources, tin=bool(self._get_from_tin_), domain=self._rconf.domain(),
+                               catchments=self._catch_ids, land_cover=self._land_cover.digest(),
+                               decimation=(self._tin_target_faces, self._tin_tolerance, self._tin_max_area_change,
+                                           DECIMATION_VERSION))
+            cached = load_geometry(self._geometry_cache_dir, key)
+            if cached is not None:
+                cell_geo_data, meta = cached
+                x_min, x_max, y_min, y_max = meta["limits"]
+                bounding_region = BoundingBoxRegion(np.array([x_min, x_max]), np.array([y_min, y_max]),
+                                                    str(meta["point_epsg"]), str(meta["target_epsg"]))
+                self.bounding_box = bounding_region.bounding_box(str(meta["target_epsg"]))
+                return cell_geo_data, list(meta["c_ids_unique"]), bounding_region
+        cell_geo_data, c_ids_unique, bounding_region = self._build_cell_geo_data()
+        if key is not None:
+            x, y = bounding_region.limits
+            cell_geo_data = save_geometry(self._geometry_cache_dir, key, cell_geo_data,
+                                          limits=np.array([x[0], x[1], y[0], y[1]]),
+                                          point_epsg=str(bounding_region.limits_epsg),
+                                          target_epsg=str(bounding_region.epsg()),
+                                          c_ids_unique=np.asarray(c_ids_unique))
+        return cell_geo_data, c_ids_unique, bounding_region
+
+    def _build_cell_geo_data(self):
         if not (self._get_from_tin_):
             with Dataset(self._data_file) as dset:
                 Vars = dset.variables
@@ -186,63 +502,22 @@ class CFRegionModelRepository(interfaces.RegionModelRepository):
                 c_ids_unique = list(np.unique(c_ids))
                 # c_indx = np.array([c_ids_unique.index(cid) for cid in c_ids]) # since ID to Index conversion not necessary
 
-                ff = Vars["forest-fraction"][mask]
-                lf = Vars["lake-fraction"][mask]
-                rf = Vars["reservoir-fraction"][mask]
-                gf = Vars["glacier-fraction"][mask]
-                uf = np.full(len(ff), 0)
+                if "cover_type" in Vars:
+                    gf, lf, rf, ff, uf = self._land_cover.fractions(Vars["cover_type"][mask]).T
+                else:
+                    ff = Vars["forest-fraction"][mask]
+                    lf = Vars["lake-fraction"][mask]
+                    rf = Vars["reservoir-fraction"][mask]
+                    gf = Vars["glacier-fraction"][mask]
+                    uf = np.full(len(ff), 0)
         else:
             tin_x0_arr, tin_y0_arr, tin_z0_arr, tin_x1_arr, tin_y1_arr, tin_z1_arr, tin_x2_arr, tin_y2_arr, tin_z2_arr, lf, gf, rf, ff, uf, c_ids, c_ids_unique, bounding_region = self.parse_tinrepo()
 
-        # Construct region parameter:
-        region_parameter = self._region_model.parameter_t()
-        for p_type_name, value_ in self._mconf.model_parameters().items():
-            if hasattr(region_parameter, p_type_name):
-                sub_param = getattr(region_parameter, p_type_name)
-                for p, v in value_.items():
-                    if hasattr(sub_param, p):
-                        setattr(sub_param, p, v)
-                    else:
-                        raise RegionConfigError("Invalid parameter '{}' for parameter set '{}'".format(p, p_type_name))
-            else:
-                raise RegionConfigError("Invalid parameter set '{}' for selected model '{}'".format(p_type_name, self._region_model.__name__))
 
-        radiation_slope_factor = 1.0
         cell_geo_data = np.column_stack([tin_x0_arr, tin_y0_arr, tin_z0_arr, tin_x1_arr, tin_y1_arr, tin_z1_arr, tin_x2_arr, tin_y2_arr, tin_z2_arr, np.full(len(tin_x0_arr), self._epsg), c_ids, gf, lf, rf, ff])
+        return cell_geo_data, c_ids_unique, bounding_region
 
-        cell_vector = self._region_model.cell_t.vector_t.create_from_geo_cell_data_vector_to_tin(np.ravel(cell_geo_data))
-
-        # Construct catchment overrides
-        catchment_parameters = self._region_model.parameter_t.map_t()
-        for cid, catch_param in self._rconf.parameter_overrides().items():
-            if cid in c_ids_unique:
-                param = self._region_model.parameter_t(region_parameter)
-                for p_type_name, value_ in catch_param.items():
-                    if hasattr(param, p_type_name):
-                        sub_param = getattr(param, p_type_name)
-                        for p, v in value_.items():
-                            if hasattr(sub_param, p):
-                                setattr(sub_param, p, v)
-                            else:
-                                raise RegionConfigError("Invalid parameter '{}' for catchment parameter set '{}'".format(p, p_type_name))
-                    else:
-                        raise RegionConfigError("Invalid catchment parameter set '{}' for selected model '{}'".format(p_type_name, self._region_model.__name__))
-
-                catchment_parameters[cid] = param
-        region_model = self._region_model(cell_vector, region_parameter, catchment_parameters)
-        region_model.bounding_region = bounding_region
-        region_model.catchment_id_map = c_ids_unique
-        def do_clone(x):
-            clone = x.__class__(x)
-            clone.bounding_region = x.bounding_region
-            clone.catchment_id_map = x.catchment_id_map
-            # clone.gis_info = polygons  # cell shapes not included yet
-            return clone
-
-        region_model.clone = do_clone
-        return region_model
-
-    def cell_data_to_netcdf(self, region_model, output_dir):
+    def cell_data_to_netcdf(self, region_model, output_dir, chunk_size=65536, complevel=4):
         """
         Writes cell_data from a shyft region_model in the same format the
          'cf_region_model_repository' expects.
@@ -253,6 +528,10 @@ class CFRegionModelRepository(interfaces.RegionModelRepository):
 
         model_id: str identifier of region_model
 
+        chunk_size: int, cells per netCDF chunk
+
+        complevel: int, zlib compression level, 0 to write uncompressed
+
         Returns
         -------
 
@@ -268,317 +547,170 @@ class CFRegionModelRepository(interfaces.RegionModelRepository):
         #     yaml.dump(repository, yml)
 
         dimensions = {'cell': len(region_model.cells)}
+        epsg = region_model.bounding_region.epsg()
 
-        variables = {'y': [np.float, ('cell',), {'axis': 'mid_Y',
-                                                 'units': 'm',
-                                                 'standard_name': 'projection_y_coordinate'}],
+        variables = {'y': [np.float64, ('cell',), {'axis': 'mid_Y',
+                                                   'units': 'm',
+                                                   'standard_name': 'projection_y_coordinate'}],
 
-                     'x': [np.float, ('cell',), {'axis': 'mid_X',
-                                                 'units': 'm',
-                                                 'standard_name': 'projection_x_coordinate'}],
+                     'x': [np.float64, ('cell',), {'axis': 'mid_X',
+                                                   'units': 'm',
+                                                   'standard_name': 'projection_x_coordinate'}],
 
-                     'z': [np.float, ('cell',), {'axis': 'mid_Z',
-                                                 'units': 'm',
-                                                 'standard_name': 'height',
-                                                 'long_name': 'height above mean sea level'}],
+                     'z': [np.float64, ('cell',), {'axis': 'mid_Z',
+                                                   'units': 'm',
+                                                   'standard_name': 'height',
+                                                   'long_name': 'height above mean sea level'}],
 
-                     'crs': [np.int32, ('cell',), {'grid_mapping_name': 'transverse_mercator',
-                                                   'epsg_code': 'EPSG:' + str(region_model.bounding_region.epsg()),
+                     'crs': [np.int32, (), {'grid_mapping_name': 'transverse_mercator',
+                                                   'epsg_code': 'EPSG:' + str(epsg),
                                                    'proj4': "+proj = utm + zone = 33 + datum = WGS84 + units = m + no_defs + ellps = WGS84 + towgs84=0,0,0"}],
 
-                     'area': [np.float, ('cell',), {'grid_mapping': 'crs',
-                                                    'units': 'm^2',
-                                                    'coordinates': 'y x z'}],
+                     'area': [np.float64, ('cell',), {'grid_mapping': 'crs',
+                                                      'units': 'm^2',
+                                                      'coordinates': 'y x z'}],
                      
-                     'forest-fraction': [np.float, ('cell',), {'grid_mapping': 'crs',
-                                                               'units': '-',
-                                                               'coordinates': 'y x z'}],
+                     'forest-fraction': [np.float64, ('cell',), {'grid_mapping': 'crs',
+                                                                 'units': '-',
+                                                                 'coordinates': 'y x z'}],
 
-                     'glacier-fraction': [np.float, ('cell',), {'grid_mapping': 'crs',
-                                                                'units': '-',
-                                                                'coordinates': 'y x z'}],
-
-                     'lake-fraction': [np.float, ('cell',), {'grid_mapping': 'crs',
-                                                             'units': '-',
-                                                             'coordinates': 'y x z'}],
-
-                     'reservoir-fraction': [np.float, ('cell',), {'grid_mapping': 'crs',
+                     'glacier-fraction': [np.float64, ('cell',), {'grid_mapping': 'crs',
                                                                   'units': '-',
                                                                   'coordinates': 'y x z'}],
 
+                     'lake-fraction': [np.float64, ('cell',), {'grid_mapping': 'crs',
+                                                               'units': '-',
+                                                               'coordinates': 'y x z'}],
+
+                     'reservoir-fraction': [np.float64, ('cell',), {'grid_mapping': 'crs',
+                                                                    'units': '-',
+                                                                    'coordinates': 'y x z'}],
+
                      'catchment_id': [np.int32, ('cell',), {'grid_mapping': 'crs',
                                                             'units': '-',
                                                             'coordinates': 'y x z'}],
-                     'x0': [np.float, ('cell',), {'axis': 'x0',
-                                                  'units': 'm',
-                                                  'standard_name': 'x0'}],
+                     'x0': [np.float64, ('cell',), {'axis': 'x0',
+                                                    'units': 'm',
+                                                    'standard_name': 'x0'}],
 
-                     'y0': [np.float, ('cell',), {'axis': 'y0',
-                                                  'units': 'm',
-                                                  'standard_name': 'y0'}],
+                     'y0': [np.float64, ('cell',), {'axis': 'y0',
+                                                    'units': 'm',
+                                                    'standard_name': 'y0'}],
                      
-                     'z0': [np.float, ('cell',), {'axis': 'z0',
-                                                  'units': 'm',
-                                                  'standard_name': 'height0',
-                                                  'long_name': 'z0'}],
-                     'x1': [np.float, ('cell',), {'axis': 'x1',
-                                                  'units': 'm',
-                                                  'standard_name': 'x1'}],
-
-                     'y1': [np.float, ('cell',), {'axis': 'y1',
-                                                  'units': 'm',
-                                                  'standard_name': 'y1'}],
-
-                     'z1': [np.float, ('cell',), {'axis': 'z1',
-                                                  'units': 'm',
-                                                  'standard_name': 'height1',
-                                                  'long_name': 'z1'}],
-                     'x2': [np.float, ('cell',), {'axis': 'x2',
-                                                  'units': 'm',
-                                                  'standard_name': 'x2'}],
-
-                     'y2': [np.float, ('cell',), {'axis': 'y2',
-                                                  'units': 'm',
-                                                  'standard_name': 'y2'}],
-
-                     'z2': [np.float, ('cell',), {'axis': 'z2',
-                                                  'units': 'm',
-                                                  'standard_name': 'height2',
-                                                  'long_name': 'z2'}],
-                     'slopes': [np.float, ('cell',), {'units': 'deg',
-                                                      'standard_name': 'slopes'}],
-                     'aspects': [np.float, ('cell',), {'units': 'deg',
-                                                       'standard_name': 'aspects'}],
+                     'z0': [np.float64, ('cell',), {'axis': 'z0',
+                                                    'units': 'm',
+                                                    'standard_name': 'height0',
+                                                    'long_name': 'z0'}],
+                     'x1': [np.float64, ('cell',), {'axis': 'x1',
+                                                    'units': 'm',
+                                                    'standard_name': 'x1'}],
+
+                     'y1': [np.float64, ('cell',), {'axis': 'y1',
+                                                    'units': 'm',
+                                                    'standard_name': 'y1'}],
+
+                     'z1': [np.float64, ('cell',), {'axis': 'z1',
+                                                    'units': 'm',
+                                                    'standard_name': 'height1',
+                                                    'long_name': 'z1'}],
+                     'x2': [np.float64, ('cell',), {'axis': 'x2',
+                                                    'units': 'm',
+                                                    'standard_name': 'x2'}],
+
+                     'y2': [np.float64, ('cell',), {'axis': 'y2',
+                                                    'units': 'm',
+                                                    'standard_name': 'y2'}],
+
+                     'z2': [np.float64, ('cell',), {'axis': 'z2',
+                                                    'units': 'm',
+                                                    'standard_name': 'height2',
+                                                    'long_name': 'z2'}],
+                     'slopes': [np.float64, ('cell',), {'units': 'deg',
+                                                        'standard_name': 'slopes'}],
+                     'aspects': [np.float64, ('cell',), {'units': 'deg',
+                                                         'standard_name': 'aspects'}],
                      }
 
-        create_ncfile(nc_file, variables, dimensions)
-        nci = Dataset(nc_file, 'a')
-
-        extracted_geo_cell_data = region_model.extract_geo_cell_data()
-        nci.variables['x'][:] = [gcd.mid_point().x for gcd in extracted_geo_cell_data]
-        nci.variables['y'][:] = [gcd.mid_point().y for gcd in extracted_geo_cell_data]
-        nci.variables['z'][:] = [gcd.mid_point().z for gcd in extracted_geo_cell_data]
-        nci.variables['area'][:] = [gcd.area() for gcd in extracted_geo_cell_data]
-        nci.variables['catchment_id'][:] = [gcd.catchment_id() for gcd in extracted_geo_cell_data]
-        nci.variables['lake-fraction'][:] = [gcd.land_type_fractions_info().lake() for gcd in extracted_geo_cell_data]
-        nci.variables['reservoir-fraction'][:] = [gcd.land_type_fractions_info().reservoir() for gcd in extracted_geo_cell_data]
-        nci.variables['glacier-fraction'][:] = [gcd.land_type_fractions_info().glacier() for gcd in extracted_geo_cell_data]
-        nci.variables['forest-fraction'][:] = [gcd.land_type_fractions_info().forest() for gcd in extracted_geo_cell_data]
-        nci.variables['x0'][:] = [gcd.vertexes()[0].x for gcd in extracted_geo_cell_data]
-        nci.variables['y0'][:] = [gcd.vertexes()[0].y for gcd in extracted_geo_cell_data]
-        nci.variables['z0'][:] = [gcd.vertexes()[0].z for gcd in extracted_geo_cell_data]
-        nci.variables['x1'][:] = [gcd.vertexes()[1].x for gcd in extracted_geo_cell_data]
-        nci.variables['y1'][:] = [gcd.vertexes()[1].y for gcd in extracted_geo_cell_data]
-        nci.variables['z1'][:] = [gcd.vertexes()[1].z for gcd in extracted_geo_cell_data]
-        nci.variables['x2'][:] = [gcd.vertexes()[2].x for gcd in extracted_geo_cell_data]
-        nci.variables['y2'][:] = [gcd.vertexes()[2].y for gcd in extracted_geo_cell_data]
-        nci.variables['z2'][:] = [gcd.vertexes()[2].z for gcd in extracted_geo_cell_data]
-        nci.variables['slopes'][:] = [gcd.slope() for gcd in extracted_geo_cell_data]
-        nci.variables['aspects'][:] = [gcd.aspect() for gcd in extracted_geo_cell_data]
-
-        nci.close()
+        # shyft only hands out geo_cell_data per cell: one python visit per cell collects the
+        # flat values, converted to the column array in one go
+        columns = ('x', 'y', 'z', 'area', 'catchment_id', 'lake-fraction', 'reservoir-fraction', 'glacier-fraction',
+                   'forest-fraction', 'x0', 'y0', 'z0', 'x1', 'y1', 'z1', 'x2', 'y2', 'z2', 'slopes', 'aspects')
+
+        def cell_values(gcd):
+            mid = gcd.mid_point()
+            v0, v1, v2 = gcd.vertexes()
+            ltf = gcd.land_type_fractions_info()
+            return (mid.x, mid.y, mid.z, gcd.area(), gcd.catchment_id(), ltf.lake(), ltf.reservoir(),
+                    ltf.glacier(), ltf.forest(), v0.x, v0.y, v0.z, v1.x, v1.y, v1.z, v2.x, v2.y, v2.z,
+                    gcd.slope(), gcd.aspect())
+
+        values = np.array([cell_values(gcd) for gcd in region_model.extract_geo_cell_data()],
+                          dtype=np.float64).reshape(-1, len(columns))
+
+        chunks = (max(1, min(dimensions['cell'], chunk_size)),)
+        compression = dict(zlib=True, complevel=complevel) if complevel > 0 else {}
+        with Dataset(nc_file, 'w') as nci:
+            for dimension, size in dimensions.items():
+                nci.createDimension(dimension, size)
+            for name, (dtype, dims, attrs) in variables.items():
+                if dims:
+                    nci.createVariable(name, dtype, dims, chunksizes=chunks, **compression).setncatts(attrs)
+                else:
+                    nci.createVariable(name, dtype, dims).setncatts(attrs)
+            nci.variables['crs'].assignValue(epsg)
+            for j, name in enumerate(columns):
+                nci.variables[name][:] = values[:, j]
 
     def parse_tinrepo(self):
-        # instead of rasputin we use pip available h5py to parse h5 files
-        import h5py
         # Construct cells from TIN repository
-        # class GlobCovLandTypes(Enum):
-        #     crop_type_1 = 11
-        #     crop_type_2 = 14
-        #     crop_type_3 = 20
-        #     crop_type_4 = 30
-        #     forest_type_1 = 40
-        #     forest_type_2 = 50
-        #     forest_type_3 = 60
-        #     forest_type_4 = 70
-        #     forest_type_5 = 90
-        #     forest_type_6 = 100
-        #     shrub_type_1 = 110
-        #     shrub_type_2 = 120
-        #     shrub_type_3 = 130
-        #     vegetation_type_1 = 140
-        #     vegetation_type_2 = 150
-        #     flood_type_1 = 160
-        #     flood_type_2 = 170
-        #     flood_type_3 = 180
-        #     artificial = 190
-        #     bare = 200
-        #     water = 210
-        #     snow_and_ice = 220
-        #     no_data = 230
-
-        # class CorineLandCoverType():
-        #     # Artificial
-        #     urban_fabric_cont = 111
-        #     urban_fabric_discont = 112
-        #     industrial_unit = 121
-        #     road_and_rail = 122
-        #     port = 123
-        #     airport = 124
-        #     mineral_extraction = 131
-        #     dump_site = 132
-        #     constrution_site = 133
-        #     urban_green = 141
-        #     sport_and_leisure = 142
-        #
-        #     # Agricultural
-        #     arable_land_non_irr = 211
-        #     permanent_irr = 212
-        #     rice_field = 213
-        #     vinyard = 221
-        #     fruit_and_berry = 222
-        #     olive_grove = 223
-        #     pasture = 231
-        #     mix_annual_permament_crop = 241
-        #     complex_cultivation = 242
-        #     mix_agri_natural = 243
-        #     agro_forestry = 244
-        #
-        #     # Forest
-        #     broad_leaved = 311
-        #     coniferous = 312
-        #     mixed_forest = 313
-        #     natural_grass = 321
-        #     moors_and_heath = 322
-        #     sclerophyllous = 323
-        #     transitional_woodland_shrub = 324
-        #     beach_dune_sand = 331
-        #     bare_rock = 332
-        #     sparse_veg = 333
-        #     burnt = 334
-        #     glacier_and_snow = 335
-        #
-        #     # Wetland
-        #     inland_march = 411
-        #     peat_bog = 412
-        #     salt_march = 421
-        #     saline = 422
-        #     intertidal_flat = 423
-        #
-        #     # Water bodies
-        #     water_course = 511
-        #     water_body = 512
-        #     coastal_lagoon = 521
-        #     estuary = 522
-        #     sea_and_ocean = 523
-
         # TODO: define more types on c++ side and make proper conversion from orchestration
-        
+
         # Right now Rasputin is not able to delineate watersheds, so the solution is to put all subcatchments insame directory and and read one-by-one
         # cid = tin_uid = filename --> key to find subcatchment
-
-        tin_v0_arr = []
-        tin_v1_arr = []
-        tin_v2_arr = []
-        lf = []
-        rf = []
-        ff = []
-        gf = []
-        uf = []
+        # each TIN file holds one catchment, files of catchments not asked for are not read at all
+        tin_uid = [tid for tid in self._tin_uid_ if self._catch_ids is None or _tin_catchment_id(tid) in self._catch_ids]
+        if not tin_uid:
+            raise CFRegionModelRepositoryError("None of the catchments {} in tin_uid {}".format(self._catch_ids, self._tin_uid_))
+        tin_files = [Path(self._tin_data_folder + "/" + tid + ".h5") for tid in tin_uid]
+        read = partial(read_tin, target_faces=self._tin_target_faces, tolerance=self._tin_tolerance,
+                       max_area_change=self._tin_max_area_change, cache_dir=self._geometry_cache_dir)
+        if len(tin_files) == 1 or self._tin_executor == "sequential":
+            tins = [read(f) for f in tin_files]
+        else:
+            executor = ProcessPoolExecutor if self._tin_executor == "process" else ThreadPoolExecutor
+            with executor(max_workers=self._tin_max_workers) as pool:
+                tins = list(pool.map(read, tin_files))  # map keeps the order of tin_uid
+        vertices = []
+        fractions = []
         c_ids = []
-        #print(self._catch_ids)
-        for tid in self._tin_uid_:
-            tin_repo = h5py.File(Path(self._tin_data_folder +"/"+ tid + ".h5"), 'r')
-            # from here I already know teh structure of the file, by asking tin_repo.keys() one can check the main groups
-            # in the rasputin generated tins main groups are "information" and "tin"
-            tins = tin_repo.get("tin")
-            # tins.keys() return "face_fields", "faces", "points"
-            points = tins.get("points")  # this is already a dataset, one cah check points.shape,
-            # in the rasputin generated tin the shape is normally (L,3), where L -- is number of vertexes
-            xarr = points[:, 0]
-            yarr = points[:, 1]
-            zarr = points[:, 2]
-            faces = tins.get('faces')
-            # now we got all our vertexes, but still need to gain information about land_types
-            # colors and codes for land_cover type are kept with tins
-            face_fields = tins.get(
-                "face_fields")  # this one carries additional information about cover_color and cover_type
-            tincolors = face_fields.get("cover_color")  # shape is same as for faces, as it is a color of face
-            land_cover_type = face_fields.get("cover_type")
-            # but text information about the name of the land_type is kept in information group
-            info = tin_repo.get("information")
-            # info.keys() returns "land_covers"
-            land_covers = info.get("land_covers")
-
-            materials = [(int(np.round(r * 255)), int(np.round(g * 255)), int(np.round(b * 255))) for (r, g, b) in
-                         tincolors]
-            cid_val = int(''.join(filter(str.isdigit, tid)))
-            pv = np.asarray(points)
-            fv = np.asarray(faces)
-            #projstring = "EPSG:32645"  # default to Nepal
-            projstring = "zone=45"
-            land_covers_names = []
-            for c in materials:
-                (value, name) = get_land_type(c, land_covers)
-                land_covers_names.append(name.decode('utf-8'))
-                print(name.decode('utf-8'))
-
-            # source_cs = v.projection
-            # TODO: if rasputin ends u with epsg string change here:
-            # source_cs = "EPSG:32633"
-            # crs = pyproj.Proj(source_cs, preserve_units=True)
-            #dataset_epsg = projstring
-            dataset_epsg = None
-            # print(projstring)
-            spstr = projstring.split(" ")
-            for k in spstr:
-                if ('zone=' in k):
-                    zone = int(k.split('=')[1])
-            # print(crs)
-            dataset_epsg = 32600 + zone
-            # print(dataset_epsg)
-            if not dataset_epsg:
-                raise interfaces.InterfaceError("netcdf: can't define epsg from proj string")
-
-            pp = np.asarray(pv)[np.asarray(fv).reshape(-1)].reshape(-1, 3)
-            v0 = np.asarray(pp[0::3]).reshape(-1).reshape(-1, 3)
-            v1 = np.asarray(pp[1::3]).reshape(-1).reshape(-1, 3)
-            # print(v1)
-            v2 = np.asarray(pp[2::3]).reshape(-1).reshape(-1, 3)
-            tin_v0_arr = np.append(tin_v0_arr, v0)
-            tin_v1_arr = np.append(tin_v1_arr, v1)
-            tin_v2_arr = np.append(tin_v2_arr, v2)
-            # TODO: make more land cover types on shyft side in main branch
-            # parsing to shyft internal types: lf -lake/water body, ff - forest, rf - reservoir, gf - glacier, uf - undefiened
-            for lc in land_covers_names:
-                print(lc)
-                if lc=="snow_and_ice":
-                    lf = np.append(lf, 0)
-                    ff = np.append(ff, 0)
-                    rf = np.append(rf, 0)
-                    gf = np.append(gf, 1)
-                    uf = np.append(uf, 0)
-                elif lc=="bare":
-                    lf = np.append(lf, 0)
-                    ff = np.append(ff, 0)
-                    rf = np.append(rf, 0)
-                    gf = np.append(gf, 0)
-                    uf = np.append(uf, 1)
-                else:
-                    lf = np.append(lf, 0)
-                    ff = np.append(ff, 1)
-                    rf = np.append(rf, 0)
-                    gf = np.append(gf, 0)
-                    uf = np.append(uf, 0)
-            print(ff)
-            c_ids = np.append(c_ids,np.full(len(v0),cid_val))
-
-            tin_x0_arr = tin_v0_arr.reshape(-1)[0::3]
-            tin_y0_arr = tin_v0_arr.reshape(-1)[1::3]
-            tin_z0_arr = tin_v0_arr.reshape(-1)[2::3]
-            tin_x1_arr = tin_v1_arr.reshape(-1)[0::3]
-            tin_y1_arr = tin_v1_arr.reshape(-1)[1::3]
-            tin_z1_arr = tin_v1_arr.reshape(-1)[2::3]
-            tin_x2_arr = tin_v2_arr.reshape(-1)[0::3]
-            tin_y2_arr = tin_v2_arr.reshape(-1)[1::3]
-            tin_z2_arr = tin_v2_arr.reshape(-1)[2::3]
-            c_ids_unique = list(np.unique(c_ids))
-            target_cs = "EPSG:{}".format(self._epsg)
-            source_cs = "EPSG:{}".format(dataset_epsg)
-            self._epsg = dataset_epsg    
-        # Construct bounding region
-        c_ids = c_ids.reshape(-1)
-        m_catch = np.ones(len(c_ids), dtype=bool)
+        for tid, (v, cover_type) in zip(tin_uid, tins):
+            vertices.append(v)
+            fractions.append(self._land_cover.fractions(cover_type))
+            c_ids.append(np.full(len(v), _tin_catchment_id(tid)))
+        if len(tins) == 1:
+            vertices, fractions, c_ids = vertices[0], fractions[0], c_ids[0]
+        else:
+            vertices = np.concatenate(vertices)
+            fractions = np.concatenate(fractions)
+            c_ids = np.concatenate(c_ids)
+        del tins
+
+        # TODO: if rasputin ends u with epsg string change here:
+        projstring = "zone=45"  # default to Nepal
+        dataset_epsg = None
+        for k in projstring.split(" "):
+            if 'zone=' in k:
+                dataset_epsg = 32600 + int(k.split('=')[1])
+        if not dataset_epsg:
+            raise interfaces.InterfaceError("netcdf: can't define epsg from proj string")
+        if str(dataset_epsg) != str(self._epsg):
+            # cells are built in the region's coordinate system
+            # vertices are owned here, so they are reprojected in place
+            xx, yy = transform_xy(f"EPSG:{dataset_epsg}", f"EPSG:{self._epsg}", vertices[:, :, 0].ravel(), vertices[:, :, 1].ravel())
+            vertices[:, :, 0] = np.reshape(xx, vertices.shape[:2])
+            vertices[:, :, 1] = np.reshape(yy, vertices.shape[:2])
+
+        # Construct bounding region and drop the faces outside it
         box_fields = set(("lower_left_x", "lower_left_y", "step_x", "step_y", "nx", "ny", "EPSG"))
         if box_fields.issubset(self._rconf.domain()):
             tmp = self._rconf.domain()
@@ -589,11 +721,18 @@ class CFRegionModelRepository(interfaces.RegionModelRepository):
             y_max = y_min + tmp["ny"]*tmp["step_y"]
             bounding_region = BoundingBoxRegion(np.array([x_min, x_max]),
                                                 np.array([y_min, y_max]), epsg, self._epsg)
+            mask = faces_in_polygon(vertices, bounding_region.bounding_polygon(str(self._epsg)))
+            if not mask.all():
+                vertices, fractions, c_ids = vertices[mask], fractions[mask], c_ids[mask]
         else:
-            bounding_region = BoundingBoxRegion(tin_x0_arr, tin_y0_arr, dataset_epsg, self._epsg)
+            bounding_region = BoundingBoxRegion(vertices[:, :, 0], vertices[:, :, 1], self._epsg, self._epsg)
         self.bounding_box = bounding_region.bounding_box(self._epsg)
-        x, y, m_xy, _ = self._limit(tin_x0_arr, tin_y0_arr, source_cs, target_cs)
-        mask = ((m_xy) & (m_catch))  # TODO utilize mask to run only on cells included into bb
+
+        c_ids_unique = list(np.unique(c_ids))
+        gf, lf, rf, ff, uf = fractions.T
+        tin_x0_arr, tin_y0_arr, tin_z0_arr = vertices[:, 0].T
+        tin_x1_arr, tin_y1_arr, tin_z1_arr = vertices[:, 1].T
+        tin_x2_arr, tin_y2_arr, tin_z2_arr = vertices[:, 2].T
         return tin_x0_arr, tin_y0_arr, tin_z0_arr, tin_x1_arr, tin_y1_arr, tin_z1_arr, tin_x2_arr, tin_y2_arr, tin_z2_arr, lf, gf, rf, ff, uf, c_ids, c_ids_unique, bounding_region
 
 
@@ -605,6 +744,9 @@ class BoundingBoxRegion(interfaces.BoundingRegion):
         x_max = x.ravel().max()
         y_min = y.ravel().min()
         y_max = y.ravel().max()
+        # extent as given, before reprojection, so the region can be rebuilt from the geometry cache
+        self.limits = np.array([x_min, x_max]), np.array([y_min, y_max])
+        self.limits_epsg = self._epsg
         self.x = np.array([x_min, x_max, x_max, x_min], dtype="d")
         self.y = np.array([y_min, y_min, y_max, y_max], dtype="d")
         self.x, self.y = self.bounding_box(target_epsg)
@@ -616,19 +758,14 @@ class BoundingBoxRegion(interfaces.BoundingRegion):
         if epsg == self.epsg():
             return np.array(self.x), np.array(self.y)
         else:
-            source_proj = make_proj(f"EPSG:{self.epsg()}")
-            target_proj = make_proj(f"EPSG:{epsg}")
-            return [np.array(a) for a in pyproj.transform(source_proj, target_proj, self.x, self.y)]
+            return list(transform_xy(f"EPSG:{self.epsg()}", f"EPSG:{epsg}", self.x, self.y))
 
     def bounding_polygon(self, epsg: int) -> Union[Polygon, MultiPolygon]:
         """Implementation of interface.BoundingRegion"""
         if epsg == self.epsg():
             return self._polygon
         else:
-            source_proj = make_proj(f"EPSG:{self.epsg()}")
-            target_proj = make_proj(f"EPSG:{epsg}")
-            project = partial(pyproj.transform, source_proj, target_proj)
-            return transform(project, self._polygon)
+            return transform_geometry(f"EPSG:{self.epsg()}", f"EPSG:{epsg}", self._polygon)
 
     def epsg(self):
         return self._epsg
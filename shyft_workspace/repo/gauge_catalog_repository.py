@@ -0,0 +1,211 @@
+"""
+Catalog backed TsRepository for discharge spread over many netCDF files.
+
+A small SQLite index maps every series id to the file holding it, its column in
+that file and the time coverage and resolution. Reads consult the index and only
+open the files covering the request.
+
+Series ids are matched on their text, so 42 and "42" find the same series, and are
+read with the type they have in the file. Results are keyed by the requested ids.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from glob import glob
+from numbers import Integral, Real
+from os import path
+import sqlite3
+import warnings
+
+from shyft.hydrology import shyftdata_dir
+from shyft.hydrology.repository import interfaces
+
+from mst_himalaya.netcdf_pool import NETCDF_LOCK, dataset_pool
+from mst_himalaya.time_axis_cache import time_axis_cache
+from mst_himalaya.wfde5_cf_ts_repository import CFTsRepository, CFTsRepositoryError
+
+# bump when _SCHEMA changes, older index files are rebuilt
+_SCHEMA_VERSION = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (filename TEXT PRIMARY KEY, mtime REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS series (
+    uid TEXT NOT NULL,
+    uid_type TEXT NOT NULL,
+    filename TEXT NOT NULL REFERENCES files(filename) ON DELETE CASCADE,
+    series_index INTEGER NOT NULL,
+    t_start INTEGER NOT NULL,
+    t_end INTEGER NOT NULL,
+    dt INTEGER,
+    PRIMARY KEY (uid, filename));
+CREATE INDEX IF NOT EXISTS series_uid ON series(uid);
+"""
+
+
+def _expand(pattern):
+    pattern = path.expandvars(pattern)
+    if not path.isabs(pattern):
+        # Relative paths will be prepended the data_dir
+        pattern = path.join(shyftdata_dir, pattern)
+    return sorted(path.abspath(f) for f in glob(pattern))
+
+
+def _uid_type(uid):
+    if isinstance(uid, Integral):
+        return "int"
+    if isinstance(uid, Real):
+        return "float"
+    return "str"
+
+
+def _native_uid(uid, uid_type):
+    """uid text of the index converted back to the type of the series_name values in the file."""
+    if uid_type == "int":
+        return int(uid)
+    if uid_type == "float":
+        return float(uid)
+    return uid
+
+
+class GaugeCatalog:
+    """
+    SQLite index of uid -> (file, series offset, time coverage, resolution).
+    """
+
+    def __init__(self, index_file):
+        self._index_file = path.expandvars(index_file)
+        with closing(self._connect()) as con, con:
+            if con.execute("PRAGMA user_version").fetchone()[0] != _SCHEMA_VERSION:
+                con.executescript("DROP TABLE IF EXISTS series; DROP TABLE IF EXISTS files;")
+                con.execute("PRAGMA user_version = {}".format(_SCHEMA_VERSION))
+            con.executescript(_SCHEMA)
+
+    def _connect(self):
+        con = sqlite3.connect(self._index_file)
+        con.execute("PRAGMA foreign_keys = ON")
+        return con
+
+    def update(self, filenames):
+        """
+        (Re)index the files that are new or modified since they were last indexed.
+
+        Returns the number of files indexed.
+        """
+        n = 0
+        with closing(self._connect()) as con, con:
+            known = dict(con.execute("SELECT filename, mtime FROM files"))
+            for filename in filenames:
+                mtime = path.getmtime(filename)
+                if known.get(filename, None) == mtime:
+                    continue
+                con.execute("DELETE FROM files WHERE filename = ?", (filename,))
+                con.execute("INSERT INTO files VALUES (?, ?)", (filename, mtime))
+                con.executemany("INSERT INTO series VALUES (?, ?, ?, ?, ?, ?, ?)", self._scan(filename))
+                n += 1
+        return n
+
+    @staticmethod
+    def _scan(filename):
+        with dataset_pool.dataset(filename) as dataset, NETCDF_LOCK:
+            if 'series_name' not in dataset.variables or 'time' not in dataset.variables:
+                raise CFTsRepositoryError("'{}' lacks series_name or time".format(filename))
+            names = list(dataset.variables['series_name'][:])
+            time, dt = time_axis_cache.get(filename, dataset.variables['time'])
+        rows = {}
+        duplicates = set()
+        for i, uid in enumerate(names):
+            if str(uid) in rows:
+                duplicates.add(str(uid))
+            # CFTsRepository reads the last column of a repeated series_name, so that one is indexed
+            rows[str(uid)] = str(uid), _uid_type(uid), filename, i, int(time[0]), int(time[-1]), dt
+        if duplicates:
+            warnings.warn("Repeated series_name in '{}': {}".format(filename, ", ".join(sorted(duplicates))))
+        return list(rows.values())
+
+    def remove_missing(self):
+        """Drop files that no longer exist from the index."""
+        with closing(self._connect()) as con, con:
+            gone = [(f,) for (f,) in con.execute("SELECT filename FROM files") if not path.isfile(f)]
+            con.executemany("DELETE FROM files WHERE filename = ?", gone)
+
+    def lookup(self, list_of_ts_id, period, filenames=None):
+        """
+        Map each requested uid to a file holding it for period, preferring files that
+        cover all of period, then the finest resolution and then the longest coverage.
+        Files only overlapping period are used when no file covers it.
+
+        Only files in filenames are considered when given.
+
+        Returns dict filename -> {uid as stored in the file: requested uid}.
+        """
+        requested = {str(u): u for u in list_of_ts_id}
+        uids = list(requested)
+        start, end = int(period.start), int(period.end)
+        rows = []
+        with closing(self._connect()) as con:
+            for i in range(0, len(uids), 500):  # stay below SQLite's bound parameter limit
+                chunk = uids[i:i + 500]
+                rows.extend(con.execute(
+                    "SELECT uid, uid_type, filename FROM series WHERE uid IN ({}) AND t_start <= ? AND t_end >= ? "
+                    "ORDER BY uid, (t_start > ? OR t_end < ?), COALESCE(dt, 1e18), t_start - t_end".format(
+                        ",".join("?"*len(chunk))),
+                    chunk + [end, start, start, end]))
+        # filtered here rather than in SQL, a long file list would exceed the bound parameter limit
+        allowed = set(filenames) if filenames is not None else None
+        by_file = {}
+        seen = set()
+        for uid, uid_type, filename in rows:
+            if uid not in seen and (allowed is None or filename in allowed):
+                seen.add(uid)
+                by_file.setdefault(filename, {})[_native_uid(uid, uid_type)] = requested[uid]
+        return by_file
+
+
+class CFTsCatalogRepository(interfaces.TsRepository):
+    """
+    TsRepository reading series from many netCDF files through a GaugeCatalog.
+    """
+
+    def __init__(self, index_file, files, var_type="discharge", max_workers=4):
+        """
+        Parameters
+        ----------
+        index_file: str
+            SQLite file holding the catalog, created if missing
+        files: list of str
+            file names or glob patterns, relative paths are taken relative to shyftdata_dir
+        var_type: str
+            name of the data variable in the files
+        max_workers: int
+            number of files read concurrently
+        """
+        self.var_name = var_type
+        self._max_workers = max_workers
+        self._catalog = GaugeCatalog(index_file)
+        filenames = sorted(set(f for pattern in files for f in _expand(pattern)))
+        if not filenames:
+            raise CFTsRepositoryError("No files matching {}".format(files))
+        self._filenames = filenames
+        self._catalog.remove_missing()
+        self._catalog.update(filenames)
+
+    @property
+    def filenames(self):
+        """Files the series are read from."""
+        return list(self._filenames)
+
+    def read(self, list_of_ts_id, period):
+        if not period.valid():
+            raise CFTsRepositoryError("period should be valid()  of type UtcPeriod")
+        by_file = self._catalog.lookup(list_of_ts_id, period, self._filenames)
+
+        def read_file(item):
+            filename, uids = item
+            tsv = CFTsRepository(filename, self.var_name).read(list(uids), period)
+            return {uids[uid]: ts for uid, ts in tsv.items()}
+
+        result = {}
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            for tsv in executor.map(read_file, by_file.items()):
+                result.update(tsv)
+        return result
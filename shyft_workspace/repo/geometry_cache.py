@@ -0,0 +1,56 @@
+"""
+Content addressed store of compiled cell geometry.
+
+The 15 column cell_geo_data array fed to create_from_geo_cell_data_vector_to_tin
+only depends on the source files, the domain, the selected catchments and the
+land cover mapping. It is stored as <key>.npy, with the small region metadata in
+<key>.npz, and loaded as a read-only memory map, so simulator and calibrator
+processes for the same region build the geometry once.
+"""
+
+import hashlib
+import json
+from os import path
+
+import numpy as np
+
+from mst_himalaya.cache_utils import atomic_write, file_hash
+
+
+def geometry_key(sources, **parts):
+    """
+    Hex digest identifying the geometry built from the files in sources under the
+    settings in parts, which must be json serializable.
+    """
+    description = {"sources": [file_hash(f) for f in sources]}
+    description.update(parts)
+    text = json.dumps(description, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _names(cache_dir, key):
+    base = path.join(cache_dir, "cell_geo_data_{}".format(key))
+    return base + ".npy", base + ".npz"
+
+
+def load_geometry(cache_dir, key):
+    """(memory mapped cell_geo_data, dict of metadata) stored under key, or None."""
+    cells_file, meta_file = _names(cache_dir, key)
+    if not (path.isfile(cells_file) and path.isfile(meta_file)):
+        return None
+    with np.load(meta_file) as meta:
+        meta = {k: meta[k] for k in meta.files}
+    return np.load(cells_file, mmap_mode="r"), meta
+
+
+def save_geometry(cache_dir, key, cell_geo_data, **meta):
+    """
+    Store cell_geo_data and the metadata arrays under key.
+
+    Returns the stored array as a read-only memory map.
+    """
+    cells_file, meta_file = _names(cache_dir, key)
+    # cells last, as they mark the entry complete
+    atomic_write(meta_file, lambda tmp: np.savez(tmp, **meta))
+    atomic_write(cells_file, lambda tmp: np.save(tmp, np.ascontiguousarray(cell_geo_data, dtype=np.float64)))
+    return np.load(cells_file, mmap_mode="r")
@@ -0,0 +1,114 @@
+"""
+Table driven mapping of land cover classes to Shyft land type fractions.
+
+The class tables live in YAML (land_cover_classes.yaml next to this module holds
+GlobCover and Corine) and are compiled into a lookup table indexed directly by
+the cover_type code, so classifying all faces or cells is one indexing operation.
+"""
+
+import hashlib
+from os import path
+
+import numpy as np
+import yaml
+
+from shyft.hydrology import shyftdata_dir
+
+# column order of LandCoverClassifier.fractions
+FRACTIONS = ("glacier", "lake", "reservoir", "forest", "unspecified")
+
+DEFAULT_CLASSES_FILE = path.join(path.dirname(path.abspath(__file__)), "land_cover_classes.yaml")
+
+
+class LandCoverClassifierError(Exception):
+    pass
+
+
+def _fraction_row(spec):
+    """Fractions in FRACTIONS order for a class given as a land type name or a mapping of fractions."""
+    if isinstance(spec, str):
+        spec = {spec: 1.0}
+    unknown = set(spec) - set(FRACTIONS)
+    if unknown:
+        raise LandCoverClassifierError("Unknown land types {}, expected some of {}".format(sorted(unknown), FRACTIONS))
+    row = np.array([float(spec.get(name, 0.0)) for name in FRACTIONS])
+    if "unspecified" not in spec:
+        row[-1] = 1.0 - row[:-1].sum()
+    if np.any(row < 0.0) or np.any(row > 1.0) or abs(row.sum() - 1.0) > 1e-9:
+        raise LandCoverClassifierError("Fractions {} do not add up to 1".format(spec))
+    return row
+
+
+class LandCoverClassifier:
+    """
+    Maps integer cover_type codes to glacier, lake, reservoir, forest and
+    unspecified fractions.
+    """
+
+    def __init__(self, classes, default=None):
+        """
+        Parameters
+        ----------
+        classes: dict
+            cover_type code: land type name or dict of land type fractions
+        default: str or dict, optional
+            class of codes not in classes, unknown codes raise when None
+        """
+        codes = [int(c) for c in classes]
+        if any(c < 0 for c in codes):
+            raise LandCoverClassifierError("cover_type codes must be non-negative")
+        n = max(codes) + 1 if codes else 0
+        # row n takes every code outside the table
+        self._table = np.full((n + 1, len(FRACTIONS)), np.nan)
+        self._known = np.zeros(n + 1, dtype=bool)
+        if default is not None:
+            self._table[:] = _fraction_row(default)
+            self._known[:] = True
+        for code, spec in classes.items():
+            self._table[int(code)] = _fraction_row(spec)
+            self._known[int(code)] = True
+        self._table.setflags(write=False)
+
+    @classmethod
+    def from_yaml(cls, filename=None, table="globcover"):
+        """
+        Classifier for one table of a YAML class file.
+
+        Parameters
+        ----------
+        filename: str, optional
+            YAML file, relative paths are taken relative to shyftdata_dir,
+            default land_cover_classes.yaml of this package
+        table: str
+            name of the table in the file
+        """
+        if filename is None:
+            filename = DEFAULT_CLASSES_FILE
+        filename = path.expandvars(filename)
+        if not path.isabs(filename):
+            filename = path.join(shyftdata_dir, filename)
+        if not path.isfile(filename):
+            raise LandCoverClassifierError("No such file '{}'".format(filename))
+        with open(filename) as f:
+            tables = yaml.safe_load(f)
+        if table not in tables:
+            raise LandCoverClassifierError("No land cover table '{}' in '{}'".format(table, filename))
+        return cls(tables[table].get("classes", {}), tables[table].get("default", None))
+
+    def digest(self):
+        """sha1 of the compiled table, identifies the mapping in cache keys."""
+        sha1 = hashlib.sha1(self._table.tobytes())
+        sha1.update(self._known.tobytes())
+        return sha1.hexdigest()
+
+    def fractions(self, cover_type):
+        """
+        (n, 5) array of fractions in FRACTIONS order for the cover_type codes.
+        """
+        codes = np.asarray(cover_type, dtype=np.int64)
+        n = len(self._table) - 1
+        idx = np.where((codes >= 0) & (codes < n), codes, n)
+        unknown = ~self._known[idx]
+        if np.any(unknown):
+            raise LandCoverClassifierError("No land cover class for cover_type {}".format(int(codes[unknown][0])))
+        return self._table[idx]
@@ -0,0 +1,152 @@
+"""
+Memory mapped columnar store for station forcing, built once from the CF station
+files read by CFDataRepos.
+
+Each payload variable is kept as one contiguous (time x station) .npy array, next
+to time.npy, x.npy, y.npy, z.npy and a forcing.json sidecar carrying the crs and
+variable list. Reads slice the memory maps directly, so cold starts only touch the
+requested pages and concurrent simulations on one node share the OS page cache.
+"""
+
+import json
+from os import path, makedirs
+
+import numpy as np
+from netCDF4 import Dataset
+from shyft.hydrology import shyftdata_dir
+from shyft.hydrology.repository.netcdf.time_conversion import convert_netcdf_time
+
+from mst_himalaya.spatial_subset_cache import spatial_subset_cache
+from mst_himalaya.proj_registry import limit_1D
+from mst_himalaya.time_axis_cache import detect_fixed_dt, make_time_slice
+from mst_himalaya.wfde5_cf_geo_ts_repository import CFDataRepos, CFDataRepositoryError, _resolve_filename
+
+META_FILE = "forcing.json"
+
+
+def convert_to_memmap(filenames, store_dir, dtype="float64", time_block=8760):
+    """
+    Convert CF station files sharing one station layout into a memory mapped store.
+
+    All files must have the same time values and station coordinates, a
+    CFDataRepositoryError is raised otherwise.
+
+    Parameters
+    ----------
+    filenames: list of str
+        netCDF files as written by raw_data_to_shyft_input.ipynb, relative paths are
+        taken relative to shyftdata_dir
+    store_dir: str
+        output directory, created if needed
+    dtype: str
+        storage type of the payload arrays, float32 or float64
+    time_block: int
+        number of time steps copied per read, bounds memory use during conversion
+    """
+    filenames = [_resolve_filename(f) for f in filenames]
+    makedirs(store_dir, exist_ok=True)
+    meta = {"variables": {}, "dtype": np.dtype(dtype).name}
+    for i, filename in enumerate(filenames):
+        with Dataset(filename) as dataset:
+            variables = dataset.variables
+            if not all(k in variables for k in ("x", "y", "z", "time", "crs")):
+                raise CFDataRepositoryError("'{}' lacks one of x, y, z, time or crs".format(filename))
+            dim_nb_series = [dim.name for dim in dataset.dimensions.values() if dim.name != 'time'][0]
+            n_time = len(dataset.dimensions["time"])
+            n_series = len(dataset.dimensions[dim_nb_series])
+            time = np.asarray(convert_netcdf_time(variables["time"].units, variables["time"]), dtype=np.int64)
+            xyz = [np.asarray(np.ma.filled(variables[k][:], np.nan), dtype=np.float64) for k in ("x", "y", "z")]
+            if i == 0:
+                np.save(path.join(store_dir, "time.npy"), time)
+                for k, values in zip(("x", "y", "z"), xyz):
+                    np.save(path.join(store_dir, k + ".npy"), values)
+                meta.update(crs=variables["crs"].proj, n_time=n_time, n_series=n_series)
+                first_time, first_xyz = time, xyz
+            elif (n_time, n_series) != (meta["n_time"], meta["n_series"]):
+                raise CFDataRepositoryError("Station layout of '{}' differs from '{}'".format(filename, filenames[0]))
+            # one time.npy and one set of coordinates serve all variables, so they must agree exactly
+            elif not np.array_equal(time, first_time):
+                raise CFDataRepositoryError("Time axis of '{}' differs from '{}'".format(filename, filenames[0]))
+            elif not all(np.array_equal(a, b, equal_nan=True) for a, b in zip(xyz, first_xyz)):
+                raise CFDataRepositoryError("Station coordinates of '{}' differ from '{}'".format(
+                    filename, filenames[0]))
+
+            for k, v in variables.items():
+                if set(v.dimensions) != {"time", dim_nb_series} or k in meta["variables"]:
+                    continue
+                out = np.lib.format.open_memmap(path.join(store_dir, k + ".npy"), mode="w+",
+                                                dtype=meta["dtype"], shape=(n_time, n_series))
+                t_axis = v.dimensions.index("time")
+                for start in range(0, n_time, time_block):
+                    stop = min(start + time_block, n_time)
+                    block = v[start:stop, :] if t_axis == 0 else v[:, start:stop].T
+                    out[start:stop, :] = np.ma.filled(block, np.nan)
+                out.flush()
+                del out
+                meta["variables"][k] = k + ".npy"
+    with open(path.join(store_dir, META_FILE), "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+class MemmapDataRepos(CFDataRepos):
+    """
+    Repository serving geo located timeseries from a store made by convert_to_memmap.
+    """
+
+    def __init__(self, epsg, store_dir, padding=5000., subset_cache_dir=None, dtype="float64",
+                 prefetch=False, prefetch_memory_mb=1024.):
+        store_dir = path.expandvars(store_dir)
+        if not path.isabs(store_dir):
+            # Relative paths will be prepended the data_dir
+            store_dir = path.join(shyftdata_dir, store_dir)
+        meta_file = path.join(store_dir, META_FILE)
+        if not path.isfile(meta_file):
+            raise CFDataRepositoryError("No memmap forcing store in '{}'".format(store_dir))
+        super().__init__(epsg, meta_file, padding=padding, subset_cache_dir=subset_cache_dir, dtype=dtype,
+                         prefetch=prefetch, prefetch_memory_mb=prefetch_memory_mb)
+        with open(meta_file) as f:
+            self._meta = json.load(f)
+
+        def load(name):
+            return np.load(path.join(store_dir, name), mmap_mode="r")
+
+        self._time = load("time.npy")
+        self._dt = detect_fixed_dt(self._time)
+        self._x, self._y, self._z = load("x.npy"), load("y.npy"), load("z.npy")
+        self._payload = {k: load(name) for k, name in self._meta["variables"].items()}
+
+    def _geometry(self, utc_period, geo_location_criteria):
+        time_slice, issubset = make_time_slice(self._time, self._dt, utc_period, CFDataRepositoryError)
+        subset_key = spatial_subset_cache.make_key(self._filename, self._meta["crs"], self.shyft_cs,
+                                                   geo_location_criteria, self._padding)
+        x, y, m_xy, xy_slice = spatial_subset_cache.get_or_compute(
+            subset_key,
+            lambda: limit_1D(np.asarray(self._x), np.asarray(self._y), self._meta["crs"], self.shyft_cs,
+                              geo_location_criteria, self._padding, CFDataRepositoryError),
+            cache_dir=self._subset_cache_dir)
+        return {"x": x, "y": y, "z": np.asarray(self._z[m_xy]), "m_xy": m_xy, "xy_slice": xy_slice,
+                "time": self._time, "dt": self._dt, "time_slice": time_slice, "issubset": issubset}
+
+    def _read_block(self, geo, input_source_types):
+        """
+        Payloads are handed to Shyft as views of the memory maps, which copies them
+        into its own series. Only a station mask that removes stations and the
+        de-accumulated fields make an extra copy first.
+        """
+        time_slice = geo["time_slice"]
+        sub_mask = geo["m_xy"][geo["xy_slice"]]
+        raw_data = {}
+        for k, mm in self._payload.items():
+            if self._nc_shyft_map.get(k, None) in input_source_types:
+                if k in self._shift_fields and geo["issubset"]:  # Add one to time slice
+                    data_time_slice = slice(time_slice.start, time_slice.stop + 1)
+                else:
+                    data_time_slice = time_slice
+                arr = mm[data_time_slice, geo["xy_slice"]]  # a view into the page cache
+                if not sub_mask.all():
+                    arr = arr.compress(sub_mask, axis=1)
+                if k in self._shift_fields:
+                    arr = np.array(arr, dtype=self._dtype)  # de-accumulation works in place, the map is read-only
+                raw_data[self._nc_shyft_map[k]] = arr, k
+        return self._to_geo_ts(raw_data, geo, input_source_types)
@@ -0,0 +1,128 @@
+"""
+Process wide pool of open netCDF4 datasets.
+
+The repositories in this package read the same handful of forcing and discharge
+files over and over (every calibration iteration, every forecast step). Opening a
+netCDF file and parsing its header is a substantial part of each small read, so
+the handles are kept open here and shared by all repository instances.
+"""
+
+from contextlib import contextmanager
+from os import path
+import threading
+
+from netCDF4 import Dataset
+
+from mst_himalaya.cache_utils import LRUCache
+
+# The netCDF-C library is not thread safe, so every call into a pooled handle is
+# serialized on this lock (the same approach xarray takes for its netCDF4 backend).
+# Callers take it around their reads only, numpy work on the results runs unlocked.
+NETCDF_LOCK = threading.RLock()
+
+
+class DatasetPoolError(Exception):
+    pass
+
+
+class _PoolEntry:
+    __slots__ = ("dataset", "users", "evicted")
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.users = 0
+        self.evicted = False
+
+
+class DatasetPool:
+    """
+    LRU pool of read-only netCDF4.Dataset handles keyed by (filename, mtime).
+
+    A file that is modified on disk gets a new key, so the stale handle is dropped
+    and the file re-opened on the next request. Handles that are in use when they
+    are evicted are closed as soon as the last user releases them.
+    """
+
+    def __init__(self, max_size=16):
+        if max_size < 1:
+            raise DatasetPoolError("max_size must be at least 1, got {}".format(max_size))
+        self._entries = LRUCache(max_size, on_evict=self._evicted)
+        # guards the user counts, every change of self._entries happens under it
+        self._lock = threading.Lock()
+
+    @property
+    def max_size(self):
+        return self._entries.max_size
+
+    @max_size.setter
+    def max_size(self, value):
+        if value < 1:
+            raise DatasetPoolError("max_size must be at least 1, got {}".format(value))
+        with self._lock:
+            self._entries.max_size = value
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _key(filename):
+        filename = path.abspath(filename)
+        try:
+            return filename, path.getmtime(filename)
+        except OSError:
+            raise DatasetPoolError("No such file '{}'".format(filename))
+
+    def _acquire(self, filename):
+        key = self._key(filename)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                # drop handles to older versions of the same file
+                for stale in [k for k in self._entries.keys() if k[0] == key[0]]:
+                    self._entries.discard(stale)
+                with NETCDF_LOCK:
+                    entry = _PoolEntry(Dataset(key[0]))
+                self._entries.put(key, entry)
+            entry.users += 1
+            return entry
+
+    def _release(self, entry):
+        with self._lock:
+            entry.users -= 1
+            if entry.evicted and entry.users == 0:
+                self._close(entry)
+
+    def _evicted(self, key, entry):
+        entry.evicted = True
+        if entry.users == 0:
+            self._close(entry)
+
+    @staticmethod
+    def _close(entry):
+        with NETCDF_LOCK:
+            if entry.dataset.isopen():
+                entry.dataset.close()
+
+    @contextmanager
+    def dataset(self, filename):
+        """
+        Context manager yielding an open dataset for filename.
+
+        The handle stays open while the context is active but is not locked: hold
+        NETCDF_LOCK around every call into it (variable reads, dimension and
+        attribute queries) and keep the processing of the results outside the lock,
+        so other threads can read meanwhile.
+        """
+        entry = self._acquire(filename)
+        try:
+            yield entry.dataset
+        finally:
+            self._release(entry)
+
+    def clear(self):
+        """Close and forget all handles (handles in use are closed on release)."""
+        with self._lock:
+            self._entries.clear()
+
+
+dataset_pool = DatasetPool()
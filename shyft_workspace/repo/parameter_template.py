@@ -0,0 +1,99 @@
+"""
+Compiled region parameter templates.
+
+The flat vector layout of a model's parameter_t (get_name(i) -> i) is resolved
+once per model type. Model and catchment parameter overrides, given as nested
+dicts {parameter set: {parameter: value}}, are then applied as one parameter_t.set
+call on a vector instead of a hasattr/getattr/setattr walk per field.
+"""
+
+import threading
+
+import numpy as np
+from shyft.hydrology.orchestration.configuration.config_interfaces import RegionConfigError
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+class ParameterTemplate:
+    """
+    name -> flat index mapping of the parameter_t of one model type.
+    """
+
+    def __init__(self, model_type):
+        self._model_type = model_type
+        self._probe = model_type.parameter_t()
+        self.size = self._probe.size()
+        self.index = {self._probe.get_name(i): i for i in range(self.size)}
+        # (parameter set, parameter) -> flat index, None for attributes outside the flat vector. Unlocked, two
+        # threads resolving the same name store the same index
+        self._resolved = {}
+
+    def _resolve(self, p_type_name, p, catchment):
+        key = p_type_name, p
+        if key not in self._resolved:
+            if not hasattr(getattr(self._probe, p_type_name), p):
+                raise RegionConfigError("Invalid parameter '{}' for {}parameter set '{}'".format(
+                    p, "catchment " if catchment else "", p_type_name))
+            self._resolved[key] = self.index.get("{}.{}".format(p_type_name, p), None)
+        return self._resolved[key]
+
+    def compile(self, overrides, catchment=False):
+        """
+        Flat indices and values of the overrides, and the (parameter set, parameter,
+        value) overrides of attributes outside the flat vector.
+        """
+        indices, values, attributes = [], [], []
+        for p_type_name, value_ in overrides.items():
+            if not hasattr(self._probe, p_type_name):
+                raise RegionConfigError("Invalid {}parameter set '{}' for selected model '{}'".format(
+                    "catchment " if catchment else "", p_type_name, self._model_type.__name__))
+            for p, v in value_.items():
+                idx = self._resolve(p_type_name, p, catchment)
+                if idx is None:
+                    attributes.append((p_type_name, p, v))
+                else:
+                    indices.append(idx)
+                    values.append(v)
+        return np.array(indices, dtype=np.int64), np.array(values, dtype=np.float64), attributes
+
+    def values(self, param):
+        """Flat parameter vector of param."""
+        return np.array([param.get(i) for i in range(self.size)])
+
+    def create(self, overrides, base=None, base_values=None, catchment=False):
+        """
+        New parameter_t with overrides applied on top of base, model defaults when None.
+
+        Parameters
+        ----------
+        overrides: dict
+            {parameter set: {parameter: value}}
+        base: parameter_t, optional
+            parameters the overrides apply to
+        base_values: np.ndarray, optional
+            flat vector of base when already known, saves reading it per call
+        catchment: bool
+            overrides are catchment overrides, only changes the error messages
+        """
+        indices, values, attributes = self.compile(overrides, catchment)
+        param = self._model_type.parameter_t() if base is None else self._model_type.parameter_t(base)
+        if len(indices):
+            vector = (self.values(param) if base_values is None else base_values).copy()
+            vector[indices] = values
+            param.set(vector.tolist())
+        for p_type_name, p, v in attributes:
+            setattr(getattr(param, p_type_name), p, v)
+        return param
+
+
+def parameter_template(model_type):
+    """Shared ParameterTemplate of model_type."""
+    with _templates_lock:
+        template = _templates.get(model_type, None)
+    if template is None:
+        template = ParameterTemplate(model_type)
+        with _templates_lock:
+            template = _templates.setdefault(model_type, template)
+    return template
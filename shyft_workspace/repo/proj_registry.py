@@ -0,0 +1,80 @@
+"""
+Shared registry of pyproj Transformers.
+
+Building a Transformer is far more expensive than using it, and the repositories
+convert between the same few coordinate systems over and over. Transformers are
+created once per (source, target) pair and every conversion is one vectorized
+call on arrays, also for shapely geometries.
+"""
+
+import re
+import threading
+
+import numpy as np
+import pyproj
+import shapely
+from shyft.hydrology.repository.netcdf.utils import _mk_proj, _validate_geo_location_criteria, make_proj
+
+_transformers = {}
+_transformers_lock = threading.Lock()
+
+
+def _proj(cs):
+    cs = re.sub(r'\+e=[-+]?0*.?0+', "+e=1e-100", str(cs))  # TODO: remove this workaround when Proj allows for +e=0
+    if cs.startswith('+') or ':' in cs or cs == 'latlong':
+        return make_proj(cs)
+    return _mk_proj(cs)
+
+
+def get_transformer(source_cs, target_cs):
+    """
+    Cached always_xy Transformer from source_cs to target_cs, given as proj strings
+    or 'EPSG:<code>'.
+    """
+    key = str(source_cs), str(target_cs)
+    with _transformers_lock:
+        transformer = _transformers.get(key, None)
+    if transformer is None:
+        transformer = pyproj.Transformer.from_proj(_proj(source_cs), _proj(target_cs), always_xy=True)
+        with _transformers_lock:
+            transformer = _transformers.setdefault(key, transformer)
+    return transformer
+
+
+def transform(source_cs, target_cs, x, y):
+    """x, y arrays converted from source_cs to target_cs."""
+    if str(source_cs) == str(target_cs):
+        return np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    xx, yy = get_transformer(source_cs, target_cs).transform(np.asarray(x, dtype=np.float64),
+                                                             np.asarray(y, dtype=np.float64))
+    return np.asarray(xx), np.asarray(yy)
+
+
+def transform_geometry(source_cs, target_cs, geometry):
+    """shapely geometry converted from source_cs to target_cs with one transform call for all its coordinates."""
+    if str(source_cs) == str(target_cs):
+        return geometry
+    return shapely.transform(geometry, lambda xy: np.column_stack(transform(source_cs, target_cs, xy[:, 0], xy[:, 1])))
+
+
+def limit_1D(x, y, data_cs, target_cs, geo_location_criteria, padding, err):
+    """
+    Same contract as shyft's _limit_1D (clipping in the data coordinate system), with
+    registry Transformers and a vectorized point in polygon test.
+    """
+    _validate_geo_location_criteria(geo_location_criteria, err)
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if geo_location_criteria is None:  # get all geo_pts in dataset
+        xy_mask = np.ones(np.size(x), dtype=bool)
+    else:
+        # Find bounding polygon in data coordinate system
+        poly = transform_geometry(target_cs, data_cs, geo_location_criteria.buffer(padding))
+        xy_mask = shapely.contains_xy(poly, x, y)
+    # Check if there is at least one point extracted and raise error if there isn't
+    if not xy_mask.any():
+        raise err("No points in dataset which are within the geo_location_criteria polygon.")
+    xy_inds = np.nonzero(xy_mask)[0]
+    # Transform from source coordinates to target coordinates
+    xx, yy = transform(data_cs, target_cs, x[xy_mask], y[xy_mask])
+    return xx, yy, xy_mask, slice(xy_inds[0], xy_inds[-1] + 1)
@@ -0,0 +1,188 @@
+"""
+Binary snapshots of fully built region models.
+
+A snapshot is one .npz file with the cell geometry in the 15 column layout of
+create_from_geo_cell_data_vector_to_tin, the region and catchment parameters as
+flat vectors, the catchment_id_map, the bounding region and optionally the
+interpolated cell environment. Calibration and experiment workers restore a ready
+to run model from it instead of going through YAML, netCDF and h5 again.
+"""
+
+import importlib
+from os import path
+
+import numpy as np
+from shyft.time_series import DoubleVector, TimeAxisFixedDeltaT, TsFixed, POINT_AVERAGE_VALUE
+from shyft.hydrology.repository import interfaces
+
+from mst_himalaya.cache_utils import atomic_write
+from mst_himalaya.cf_region_model_repository_tin import BoundingBoxRegion
+from mst_himalaya.parameter_template import parameter_template
+
+# cell.env_ts members in the order they are stored
+ENV_TS = ("temperature", "precipitation", "radiation", "wind_speed", "rel_hum")
+
+
+class RegionModelSnapshotError(Exception):
+    pass
+
+
+def geo_cell_data_array(region_model):
+    """(n_cells, 15) cell_geo_data array of region_model, visiting each cell once."""
+    epsg = float(region_model.bounding_region.epsg())
+    gcds = region_model.extract_geo_cell_data()
+    cells = np.empty((len(gcds), 15))
+    for i, gcd in enumerate(gcds):
+        v0, v1, v2 = gcd.vertexes()
+        ltf = gcd.land_type_fractions_info()
+        cells[i] = (v0.x, v0.y, v0.z, v1.x, v1.y, v1.z, v2.x, v2.y, v2.z, epsg, gcd.catchment_id(),
+                    ltf.glacier(), ltf.lake(), ltf.reservoir(), ltf.forest())
+    return cells
+
+
+def _bounding_limits(bounding_region):
+    epsg = bounding_region.epsg()
+    if hasattr(bounding_region, "limits"):
+        (x_min, x_max), (y_min, y_max) = bounding_region.limits
+        return np.array([x_min, x_max, y_min, y_max]), str(bounding_region.limits_epsg), str(epsg)
+    x, y = bounding_region.bounding_box(epsg)
+    return np.array([min(x), max(x), min(y), max(y)]), str(epsg), str(epsg)
+
+
+def save_snapshot(region_model, filename, with_environment=False):
+    """
+    Write a snapshot of region_model to filename.
+
+    Parameters
+    ----------
+    region_model: shyft region model
+        built by one of the region model repositories
+    filename: str
+        .npz file written, the extension is appended when missing as np.savez does
+    with_environment: bool
+        also store cell.env_ts, the model must have an initialized and interpolated cell environment
+    """
+    filename = str(filename)
+    if not filename.endswith(".npz"):
+        filename += ".npz"
+    model_type = region_model.__class__
+    template = parameter_template(model_type)
+    region_parameter = region_model.get_region_parameter()
+    cids = [int(cid) for cid in region_model.catchment_id_map if region_model.has_catchment_parameter(int(cid))]
+    limits, point_epsg, epsg = _bounding_limits(region_model.bounding_region)
+    data = dict(model_type=np.array("{}.{}".format(model_type.__module__, model_type.__name__)),
+                cells=geo_cell_data_array(region_model),
+                region_parameter=template.values(region_parameter),
+                catchment_parameter_ids=np.array(cids, dtype=np.int64),
+                catchment_parameters=np.array([template.values(region_model.get_catchment_parameter(cid))
+                                               for cid in cids]).reshape(len(cids), template.size),
+                catchment_id_map=np.asarray(list(region_model.catchment_id_map)),
+                bounding_limits=limits, bounding_point_epsg=np.array(point_epsg), bounding_epsg=np.array(epsg))
+    if with_environment:
+        ta = region_model.time_axis
+        # all n + 1 time points, the step is checked when the environment is restored
+        data["env_time_points"] = np.array([int(ta.time(i)) for i in range(ta.size())] + [int(ta.total_period().end)],
+                                           dtype=np.int64)
+        env = np.empty((len(ENV_TS), len(region_model.cells), ta.size()))
+        for j, cell in enumerate(region_model.cells):
+            for i, name in enumerate(ENV_TS):
+                env[i, j] = getattr(cell.env_ts, name).values.to_numpy()
+        data["env_ts"] = env
+
+    atomic_write(filename, lambda tmp: np.savez(tmp, **data))
+
+
+def _clone(x):
+    clone = x.__class__(x)
+    clone.bounding_region = x.bounding_region
+    clone.catchment_id_map = x.catchment_id_map
+    return clone
+
+
+def _env_time_axis(points, filename):
+    """Fixed step time axis of the stored env time points, as Shyft's cell environment requires."""
+    dt = np.diff(points)
+    if len(dt) == 0 or np.any(dt != dt[0]):
+        raise RegionModelSnapshotError("Cell environment of '{}' is not on a fixed step time axis".format(filename))
+    return TimeAxisFixedDeltaT(int(points[0]), int(dt[0]), len(dt))
+
+
+def load_snapshot(filename, model_type=None, catchments=None):
+    """
+    Restore the region model stored in filename.
+
+    Parameters
+    ----------
+    filename: str
+        snapshot written by save_snapshot
+    model_type: shyft region model class, optional
+        model to build, defaults to the class the snapshot was taken from
+    catchments: list of int, optional
+        restore only the cells of these catchments, all when None
+
+    Returns
+    -------
+    region_model: shyft.api type
+        with the cell environment initialized and filled when the snapshot holds it
+    """
+    if not path.isfile(filename):
+        raise RegionModelSnapshotError("No such file '{}'".format(filename))
+    with np.load(filename) as f:
+        data = {k: f[k] for k in f.files}
+    if model_type is None:
+        module_name, _, class_name = str(data["model_type"]).rpartition(".")
+        model_type = getattr(importlib.import_module(module_name), class_name)
+
+    if parameter_template(model_type).size != len(data["region_parameter"]):
+        raise RegionModelSnapshotError("Snapshot '{}' does not hold parameters of {}".format(filename, model_type.__name__))
+    region_parameter = model_type.parameter_t()
+    region_parameter.set(data["region_parameter"].tolist())
+    cells = data["cells"]
+    catchment_id_map = data["catchment_id_map"].tolist()
+    rows = None
+    if catchments is not None:
+        wanted = set(int(c) for c in catchments)
+        missing = wanted - set(int(c) for c in catchment_id_map)
+        if missing:
+            raise RegionModelSnapshotError("Catchments {} not in snapshot '{}'".format(sorted(missing), filename))
+        rows = np.flatnonzero(np.isin(cells[:, 10], list(wanted)))
+        cells = cells[rows]
+        catchment_id_map = [cid for cid in catchment_id_map if int(cid) in wanted]
+
+    catchment_parameters = model_type.parameter_t.map_t()
+    for cid, values in zip(data["catchment_parameter_ids"].tolist(), data["catchment_parameters"]):
+        if catchments is not None and cid not in wanted:
+            continue
+        param = model_type.parameter_t()
+        param.set(values.tolist())
+        catchment_parameters[cid] = param
+
+    cell_vector = model_type.cell_t.vector_t.create_from_geo_cell_data_vector_to_tin(np.ravel(cells))
+    region_model = model_type(cell_vector, region_parameter, catchment_parameters)
+    x_min, x_max, y_min, y_max = data["bounding_limits"]
+    region_model.bounding_region = BoundingBoxRegion(np.array([x_min, x_max]), np.array([y_min, y_max]),
+                                                     str(data["bounding_point_epsg"]), str(data["bounding_epsg"]))
+    region_model.catchment_id_map = catchment_id_map
+    region_model.clone = _clone
+
+    if "env_ts" in data:
+        ta = _env_time_axis(data["env_time_points"], filename)
+        region_model.initialize_cell_environment(ta)
+        env = data["env_ts"] if rows is None else data["env_ts"][:, rows]
+        for j, cell in enumerate(region_model.cells):
+            for i, name in enumerate(ENV_TS):
+                setattr(cell.env_ts, name, TsFixed(ta, DoubleVector.from_numpy(env[i, j]), POINT_AVERAGE_VALUE))
+    return region_model
+
+
+class RegionModelSnapshotRepository(interfaces.RegionModelRepository):
+    """
+    RegionModelRepository serving the region model of a snapshot file.
+    """
+
+    def __init__(self, snapshot_file, model_type=None):
+        self._snapshot_file = path.expandvars(snapshot_file)
+        self._model_type = model_type
+
+    def get_region_model(self, region_id, catchments=None):
+        return load_snapshot(self._snapshot_file, self._model_type, catchments)
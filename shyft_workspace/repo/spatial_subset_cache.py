@@ -0,0 +1,84 @@
+"""
+Memoized results of shyft's _limit_1D for station based forcing files.
+
+Station layout and geo_location_criteria do not change between calibration runs,
+so the reprojected coordinates, the bounding box mask and the xy slice are
+computed once per (file, source crs, target crs, criteria, padding) and reused,
+in memory and optionally from .npz files in a cache directory.
+"""
+
+import hashlib
+from os import path
+
+import numpy as np
+
+from mst_himalaya.cache_utils import LRUCache, atomic_write, key_digest
+
+
+def criteria_hash(geo_location_criteria):
+    """Stable hash of a shapely geometry (or None) used as part of the cache key."""
+    if geo_location_criteria is None:
+        return ""
+    return hashlib.sha1(geo_location_criteria.wkt.encode("utf-8")).hexdigest()
+
+
+class SpatialSubsetCache:
+    """
+    LRU cache of (x, y, xy_mask, xy_slice) tuples as returned by _limit_1D.
+    """
+
+    def __init__(self, max_size=128):
+        self._entries = LRUCache(max_size)
+
+    @staticmethod
+    def make_key(filename, source_cs, target_cs, geo_location_criteria, padding):
+        filename = path.abspath(filename)
+        return (filename, path.getmtime(filename), str(source_cs), str(target_cs),
+                criteria_hash(geo_location_criteria), float(padding))
+
+    @staticmethod
+    def _disk_name(cache_dir, key):
+        return path.join(cache_dir, "limit_1d_{}.npz".format(key_digest(key)))
+
+    def get_or_compute(self, key, compute, cache_dir=None):
+        """
+        Return the cached subset for key, calling compute() to create it on a miss.
+
+        Parameters
+        ----------
+        key: tuple
+            as returned by make_key
+        compute: callable
+            returning (x, y, xy_mask, xy_slice), typically wrapping _limit_1D
+        cache_dir: str, optional
+            directory where results are persisted between processes
+        """
+        def load_or_compute():
+            value = self._load(self._disk_name(cache_dir, key)) if cache_dir is not None else None
+            if value is None:
+                value = compute()
+                if cache_dir is not None:
+                    self._save(self._disk_name(cache_dir, key), value)
+            return value
+
+        return self._entries.get_or_compute(key, load_or_compute)
+
+    @staticmethod
+    def _load(filename):
+        if not path.isfile(filename):
+            return None
+        with np.load(filename) as data:
+            start, stop = data["xy_slice"]
+            return data["x"], data["y"], data["xy_mask"], slice(int(start), int(stop))
+
+    @staticmethod
+    def _save(filename, value):
+        x, y, xy_mask, xy_slice = value
+        atomic_write(filename, lambda tmp: np.savez(tmp, x=np.asarray(x), y=np.asarray(y), xy_mask=np.asarray(xy_mask),
+                                                    xy_slice=np.array([xy_slice.start, xy_slice.stop])))
+
+    def clear(self):
+        self._entries.clear()
+
+
+spatial_subset_cache = SpatialSubsetCache()
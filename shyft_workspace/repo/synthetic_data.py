@@ -0,0 +1,148 @@
+"""
+Writers for synthetic CF station files with the exact layout produced by
+raw_data_to_shyft_input.ipynb (forcing) and discharge_data_to_netcdf.ipynb
+(discharge), so the repositories can be measured at realistic sizes without the
+WFDE5 extracts.
+"""
+
+from os import path, makedirs
+
+import numpy as np
+from netCDF4 import Dataset
+
+# nc variable name, units, generator(time_in_hours, station_index, rng) -> values
+_FORCING = {
+    "temperature": ("degC", lambda t, s, rng: 10.0 + 10.0*np.sin(2*np.pi*t/8760.)[:, None]
+                    - 0.0065*(s*0.5)[None, :] + rng.normal(0., 1., (len(t), len(s)))),
+    "precipitation": ("mm/h", lambda t, s, rng: np.maximum(rng.normal(-0.5, 1., (len(t), len(s))), 0.)),
+    "wind_speed": ("m s-1", lambda t, s, rng: np.abs(rng.normal(2., 1., (len(t), len(s))))),
+    "relative_humidity": ("1", lambda t, s, rng: np.clip(rng.normal(0.7, 0.1, (len(t), len(s))), 0., 1.)),
+    "global_radiation": ("W m-2", lambda t, s, rng: np.maximum(400.*np.sin(2*np.pi*t/24.), 0.)[:, None]
+                         * np.ones(len(s))[None, :]),
+}
+
+FORCING_FILES = {k: k + ".nc" for k in _FORCING}
+FORCING_FILES["global_radiation"] = "radiation.nc"
+
+PROJ = "+proj=utm +zone=45 +ellps=WGS84 +datum=WGS84 +units=m +no_defs"
+EPSG = 32645
+
+
+def _station_coordinates(n_stations, lower_left=(250828., 3100180.), spacing=1000.):
+    side = int(np.ceil(np.sqrt(n_stations)))
+    i = np.arange(n_stations)
+    x = lower_left[0] + spacing*(i % side)
+    y = lower_left[1] + spacing*(i//side)
+    z = 500. + 6000.*(i//side)/max(side - 1, 1)
+    return x, y, z
+
+
+def _write_crs(ds):
+    crs = ds.createVariable("crs", "i4")
+    crs.proj = PROJ
+    crs.grid_mapping_name = "transverse_mercator"
+    crs.epsg_code = "EPSG:{}".format(EPSG)
+    crs.assignValue(-2147483647)
+
+
+def _write_xyz(ds, dim, x, y, z):
+    for name, values, axis, std in (("x", x, "X", "projection_x_coordinate"),
+                                    ("y", y, "Y", "projection_y_coordinate"),
+                                    ("z", z, "Z", "height")):
+        v = ds.createVariable(name, "f8", (dim,))
+        v.axis = axis
+        v.standard_name = std
+        v.units = "m"
+        if name == "z":
+            v.long_name = "height above mean sea level"
+        v[:] = values
+
+
+def write_forcing_files(out_dir, n_stations=100, n_steps=8760, dt_hours=1, chunks=None,
+                        variables=None, time_block=8760, seed=0):
+    """
+    Write one station file per forcing variable into out_dir.
+
+    Parameters
+    ----------
+    out_dir: str
+        output directory, created if needed
+    n_stations: int
+        number of stations, laid out on a regular grid in UTM 45N
+    n_steps: int
+        number of time steps starting 2000-01-01
+    dt_hours: int
+        step length, 1 for hourly and 24 for daily data
+    chunks: tuple of int, optional
+        netCDF chunk sizes (time, station), contiguous storage when None
+    variables: list of str, optional
+        subset of the nc variable names, default all five forcing variables
+    time_block: int
+        number of steps generated and written at a time
+
+    Returns
+    -------
+    dict of nc variable name: filename
+    """
+    makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    x, y, z = _station_coordinates(n_stations)
+    stations = np.arange(n_stations)
+    files = {}
+    for name in variables or list(_FORCING):
+        units, generate = _FORCING[name]
+        filename = path.join(out_dir, FORCING_FILES[name])
+        with Dataset(filename, "w", format="NETCDF4") as ds:
+            ds.createDimension("time", n_steps)
+            ds.createDimension("station", n_stations)
+            time = ds.createVariable("time", "i8", ("time",))
+            time.units = "hours since 2000-01-01 00:00:00"
+            time.calendar = "proleptic_gregorian"
+            time[:] = np.arange(n_steps)*dt_hours
+            _write_xyz(ds, "station", x, y, z)
+            series_name = ds.createVariable("series_name", "i8", ("station",))
+            series_name.cf_role = "timeseries_id"
+            series_name[:] = stations
+            _write_crs(ds)
+            kw = {"chunksizes": chunks} if chunks else {"contiguous": True}
+            var = ds.createVariable(name, "f8", ("time", "station"), **kw)
+            var.units = units
+            var.grid_mapping = "crs"
+            for start in range(0, n_steps, time_block):
+                stop = min(start + time_block, n_steps)
+                var[start:stop, :] = generate(np.arange(start, stop)*float(dt_hours), stations, rng)
+        files[name] = filename
+    return files
+
+
+def write_discharge_file(filename, n_series=1, n_steps=1827, dt_hours=24, chunks=None, seed=0):
+    """
+    Write a discharge file with n_series gauges named gauge_0, gauge_1, ...
+
+    Returns the list of series names.
+    """
+    makedirs(path.dirname(path.abspath(filename)), exist_ok=True)
+    rng = np.random.default_rng(seed)
+    x, y, z = _station_coordinates(n_series, spacing=5000.)
+    names = ["gauge_{}".format(i) for i in range(n_series)]
+    with Dataset(filename, "w", format="NETCDF4") as ds:
+        ds.createDimension("time", n_steps)
+        ds.createDimension("series", n_series)
+        time = ds.createVariable("time", "i8", ("time",))
+        time.units = "hours since 2000-01-01 00:00:00"
+        time.calendar = "proleptic_gregorian"
+        time[:] = np.arange(n_steps)*dt_hours
+        _write_xyz(ds, "series", x, y, z)
+        series_name = ds.createVariable("series_name", str, ("series",))
+        series_name.cf_role = "timeseries_id"
+        series_name[:] = np.array(names, dtype=object)
+        catchment_id = ds.createVariable("catchment_id", "i4", ("series",))
+        catchment_id[:] = np.arange(n_series) + 1
+        _write_crs(ds)
+        kw = {"chunksizes": chunks} if chunks else {"contiguous": True}
+        discharge = ds.createVariable("discharge", "f8", ("time", "series"), **kw)
+        discharge.units = "m3 s-1"
+        discharge.grid_mapping = "crs"
+        season = 50. + 150.*np.maximum(np.sin(2*np.pi*(np.arange(n_steps)*dt_hours/8760. - 0.3)), 0.)
+        discharge[:] = season[:, None]*rng.lognormal(0., 0.2, (n_steps, n_series))
+    return names
@@ -0,0 +1,148 @@
+"""
+Cache of calibration target series averaged onto their calibration time axis.
+
+ConfigCalibrator reads every target series and averages it with TsTransform for
+each calibrator constructed. The averaged values only depend on the series, the
+content of the file it is read from and the (start, dt, n) axis, so they are kept
+in memory and optionally in a cache directory, and CachedConfigCalibrator builds
+the TargetSpecificationVector from them.
+"""
+
+import hashlib
+from os import path
+
+import numpy as np
+from shyft.hydrology import TargetSpecificationVector, TargetSpecificationPts, TsTransform
+from shyft.hydrology.orchestration.simulators.config_simulator import ConfigCalibrator, ConfigSimulatorError
+from shyft.time_series import DoubleVector, IntVector, TimeAxis, TimeSeries, UtcPeriod, POINT_AVERAGE_VALUE
+
+from mst_himalaya.cache_utils import LRUCache, atomic_write, file_hash, key_digest
+
+
+def repository_hash(repository):
+    """
+    Hash of the type and variable of a target repository and of the files behind it,
+    or None when the repository does not list its files and can not be cached.
+    """
+    filenames = getattr(repository, "filenames", None)
+    if not filenames:
+        return None
+    cls = type(repository)
+    # repositories reading another variable of the same files must not share entries
+    sha1 = hashlib.sha1("{}.{}:{}".format(cls.__module__, cls.__qualname__,
+                                          getattr(repository, "var_name", None)).encode("utf-8"))
+    for filename in sorted(filenames):
+        sha1.update(file_hash(filename).encode("utf-8"))
+    return sha1.hexdigest()
+
+
+class TargetSeriesCache:
+    """
+    LRU cache of averaged target values keyed by (uid, repository hash, start, dt, n) and
+    the period the series was read for.
+    """
+
+    def __init__(self, max_size=256):
+        self._entries = LRUCache(max_size)
+
+    @staticmethod
+    def make_key(uid, source_hash, start, dt, n, read_period):
+        return str(uid), source_hash, int(start), int(dt), int(n), int(read_period.start), int(read_period.end)
+
+    @staticmethod
+    def _disk_name(cache_dir, key):
+        return path.join(cache_dir, "target_{}.npy".format(key_digest(key)))
+
+    def get(self, key, cache_dir=None):
+        """Cached values for key, or None. The returned array is shared and read-only."""
+        values = self._entries.get(key)
+        if values is not None or cache_dir is None:
+            return values
+        filename = self._disk_name(cache_dir, key)
+        if not path.isfile(filename):
+            return None
+        values = np.load(filename)
+        values.setflags(write=False)
+        return self._entries.put(key, values)
+
+    def put(self, key, values, cache_dir=None):
+        values = np.array(values, dtype=np.float64)
+        if cache_dir is not None:
+            atomic_write(self._disk_name(cache_dir, key), lambda tmp: np.save(tmp, values))
+        values.setflags(write=False)
+        return self._entries.put(key, values)
+
+    def clear(self):
+        self._entries.clear()
+
+
+target_series_cache = TargetSeriesCache()
+
+
+class CachedConfigCalibrator(ConfigCalibrator):
+    """
+    ConfigCalibrator taking the averaged target series from target_series_cache.
+
+    The cache directory is the cache_dir argument, or target_cache_dir of the
+    calibration config when given there. Without either only the in-process cache
+    is used.
+    """
+
+    def __init__(self, config, cache_dir=None):
+        if cache_dir is None:
+            cache_dir = getattr(config, "target_cache_dir", None)
+        # must be set before ConfigCalibrator.__init__ builds the target specification
+        self.target_cache_dir = path.expandvars(cache_dir) if cache_dir is not None else None
+        super().__init__(config)
+
+    def _averaged_targets(self, repo):
+        """uid -> averaged values for the 1D_timeseries of one target repository."""
+        ts_infos = repo['1D_timeseries']
+        read_period = self.time_axis.total_period()
+        # validated before anything is cached, targets outside the read period average NaN padding
+        for ts_info in ts_infos:
+            period = UtcPeriod(ts_info['start_datetime'],
+                               ts_info['start_datetime'] + ts_info['number_of_steps']*ts_info['run_time_step'])
+            if not read_period.contains(period):
+                raise ConfigSimulatorError(
+                    "Period {} for target series {} is not within the full simulation period {}.".format(
+                        period.to_string(), ts_info['uid'], read_period.to_string()))
+        source_hash = repository_hash(repo['repository'])
+        keys = [TargetSeriesCache.make_key(ts_info['uid'], source_hash, ts_info['start_datetime'],
+                                           ts_info['run_time_step'], ts_info['number_of_steps'], read_period)
+                for ts_info in ts_infos]
+        values = [target_series_cache.get(key, self.target_cache_dir) if source_hash is not None else None
+                  for key in keys]
+        missing = [i for i, v in enumerate(values) if v is None]
+        if missing:
+            tst = TsTransform()
+            tsp = repo['repository'].read(list(set(ts_infos[i]['uid'] for i in missing)), read_period)
+            for i in missing:
+                ts_info = ts_infos[i]
+                if ts_info['uid'] not in tsp:
+                    raise ConfigSimulatorError("Target series {} not found.".format(ts_info['uid']))
+                avg = tst.to_average(ts_info['start_datetime'], ts_info['run_time_step'],
+                                     ts_info['number_of_steps'], tsp[ts_info['uid']])
+                values[i] = avg.values.to_numpy()
+                if source_hash is not None:
+                    values[i] = target_series_cache.put(keys[i], values[i], self.target_cache_dir)
+        return values
+
+    def _create_target_specvect(self):
+        tv = TargetSpecificationVector()
+        cid_map = self.region_model.catchment_id_map
+        for repo in self.target_repo:
+            for ts_info, values in zip(repo['1D_timeseries'], self._averaged_targets(repo)):
+                if np.count_nonzero(np.isin(cid_map, ts_info['catch_id'])) != len(ts_info['catch_id']):
+                    raise ConfigSimulatorError("Catchment ID {} for target series {} not found.".format(
+                        ','.join([str(val) for val in [i for i in ts_info['catch_id'] if i not in cid_map]]), ts_info['uid']))
+                t = TargetSpecificationPts()
+                t.uid = ts_info['uid']
+                t.catchment_indexes = IntVector(ts_info['catch_id'])
+                t.scale_factor = ts_info['weight']
+                t.calc_mode = self.obj_funcs[ts_info['obj_func']['name']]
+                [setattr(t, nm, ts_info['obj_func']['scaling_factors'][k]) for nm, k in zip(['s_r', 's_a', 's_b'], ['s_corr', 's_var', 's_bias'])]
+                ta = TimeAxis(ts_info['start_datetime'], ts_info['run_time_step'], ts_info['number_of_steps'])
+                t.ts = TimeSeries(ta, DoubleVector.from_numpy(values), POINT_AVERAGE_VALUE)
+                tv.append(t)
+        return tv
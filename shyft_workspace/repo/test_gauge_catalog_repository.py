@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+pytest.importorskip("shyft.time_series", exc_type=ImportError)
+from shyft.time_series import UtcPeriod
+
+from mst_himalaya.gauge_catalog_repository import GaugeCatalog
+from mst_himalaya.synthetic_data import write_discharge_file, write_forcing_files
+
+T0 = 946684800  # 2000-01-01
+DAY = 86400
+
+
+@pytest.fixture
+def files(tmp_path):
+    daily = str(tmp_path/"daily.nc")
+    hourly = str(tmp_path/"hourly.nc")
+    write_discharge_file(daily, n_series=3, n_steps=365, dt_hours=24)
+    write_discharge_file(hourly, n_series=2, n_steps=30*24, dt_hours=1)
+    return daily, hourly
+
+
+@pytest.fixture
+def catalog(tmp_path, files):
+    catalog = GaugeCatalog(str(tmp_path/"index.sqlite"))
+    assert catalog.update(files) == 2
+    return catalog
+
+
+def test_lookup_prefers_finest_resolution(catalog, files):
+    daily, hourly = files
+    by_file = catalog.lookup(["gauge_0", "gauge_1", "gauge_2"], UtcPeriod(T0, T0 + 10*DAY))
+    assert by_file == {hourly: {"gauge_0": "gauge_0", "gauge_1": "gauge_1"}, daily: {"gauge_2": "gauge_2"}}
+
+
+def test_lookup_prefers_file_covering_period(catalog, files):
+    daily, hourly = files
+    # the hourly file only overlaps the first 30 days
+    assert catalog.lookup(["gauge_0"], UtcPeriod(T0, T0 + 100*DAY)) == {daily: {"gauge_0": "gauge_0"}}
+    assert catalog.lookup(["gauge_0"], UtcPeriod(T0 + 20*DAY, T0 + 25*DAY)) == {hourly: {"gauge_0": "gauge_0"}}
+
+
+def test_lookup_falls_back_to_overlapping_file(catalog, files):
+    daily, _ = files
+    assert catalog.lookup(["gauge_0"], UtcPeriod(T0 + 300*DAY, T0 + 400*DAY)) == {daily: {"gauge_0": "gauge_0"}}
+    assert catalog.lookup(["gauge_0"], UtcPeriod(T0 + 400*DAY, T0 + 410*DAY)) == {}
+    assert catalog.lookup(["unknown"], UtcPeriod(T0, T0 + DAY)) == {}
+
+
+def test_lookup_only_considers_given_files(catalog, files):
+    daily, hourly = files
+    period = UtcPeriod(T0, T0 + 10*DAY)
+    assert catalog.lookup(["gauge_0", "gauge_2"], period, [daily]) == {daily: {"gauge_0": "gauge_0",
+                                                                               "gauge_2": "gauge_2"}}
+    assert catalog.lookup(["gauge_2"], period, [hourly]) == {}
+
+
+def test_lookup_matches_ids_on_text_and_keeps_their_type(tmp_path):
+    filename = write_forcing_files(str(tmp_path), n_stations=4, n_steps=48, variables=["temperature"])["temperature"]
+    catalog = GaugeCatalog(str(tmp_path/"index.sqlite"))
+    catalog.update([filename])
+    period = UtcPeriod(T0, T0 + DAY)
+    assert catalog.lookup([3], period) == {filename: {3: 3}}
+    assert catalog.lookup(["3"], period) == {filename: {3: "3"}}
+
+
+def test_update_reindexes_modified_and_drops_missing_files(catalog, files):
+    daily, hourly = files
+    assert catalog.update(files) == 0
+    # the shared dataset pool may still hold the old version open, so the new one is moved in place
+    write_discharge_file(daily + ".new", n_series=1, n_steps=365, dt_hours=24)
+    os.replace(daily + ".new", daily)
+    mtime = os.path.getmtime(daily) + 10.
+    os.utime(daily, (mtime, mtime))
+    assert catalog.update(files) == 1
+    assert catalog.lookup(["gauge_2"], UtcPeriod(T0, T0 + DAY)) == {}
+    os.remove(hourly)
+    catalog.remove_missing()
+    assert catalog.lookup(["gauge_0"], UtcPeriod(T0, T0 + DAY)) == {daily: {"gauge_0": "gauge_0"}}
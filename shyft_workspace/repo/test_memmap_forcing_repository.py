@@ -0,0 +1,37 @@
+import json
+from os import path
+
+import numpy as np
+import pytest
+from netCDF4 import Dataset
+
+pytest.importorskip("shyft.hydrology", exc_type=ImportError)
+from mst_himalaya.memmap_forcing_repository import META_FILE, convert_to_memmap
+from mst_himalaya.synthetic_data import write_forcing_files
+from mst_himalaya.wfde5_cf_geo_ts_repository import CFDataRepositoryError
+
+
+@pytest.fixture
+def files(tmp_path):
+    return write_forcing_files(str(tmp_path/"forcing"), n_stations=4, n_steps=48,
+                               variables=["temperature", "precipitation"])
+
+
+def test_convert_to_memmap_copies_all_variables(files, tmp_path):
+    store = str(tmp_path/"store")
+    convert_to_memmap(list(files.values()), store, time_block=10)
+    with open(path.join(store, META_FILE)) as f:
+        meta = json.load(f)
+    assert set(meta["variables"]) == set(files)
+    for name, filename in files.items():
+        with Dataset(filename) as ds:
+            assert np.array_equal(np.load(path.join(store, meta["variables"][name])), ds.variables[name][:])
+            assert np.array_equal(np.load(path.join(store, "x.npy")), ds.variables["x"][:])
+
+
+@pytest.mark.parametrize("variable, shift", [("time", 1), ("x", 10.), ("z", 1.)])
+def test_convert_to_memmap_rejects_misaligned_files(files, tmp_path, variable, shift):
+    with Dataset(files["precipitation"], "a") as ds:
+        ds.variables[variable][:] = ds.variables[variable][:] + shift
+    with pytest.raises(CFDataRepositoryError):
+        convert_to_memmap([files["temperature"], files["precipitation"]], str(tmp_path/"store"))
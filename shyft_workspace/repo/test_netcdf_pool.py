@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from mst_himalaya.netcdf_pool import NETCDF_LOCK, DatasetPool, DatasetPoolError
+from mst_himalaya.synthetic_data import write_discharge_file
+
+
+@pytest.fixture
+def files(tmp_path):
+    names = []
+    for i in range(3):
+        filename = str(tmp_path/"discharge_{}.nc".format(i))
+        write_discharge_file(filename, n_series=2, n_steps=10, seed=i)
+        names.append(filename)
+    return names
+
+
+def test_pool_reuses_open_handle(files):
+    pool = DatasetPool(max_size=2)
+    with pool.dataset(files[0]) as first:
+        pass
+    with pool.dataset(files[0]) as second:
+        assert second is first
+        assert second.isopen()
+    assert len(pool) == 1
+
+
+def test_pool_evicts_least_recently_used(files):
+    pool = DatasetPool(max_size=2)
+    handles = []
+    for filename in files:
+        with pool.dataset(filename) as dataset:
+            handles.append(dataset)
+    assert len(pool) == 2
+    assert not handles[0].isopen()
+    assert handles[1].isopen() and handles[2].isopen()
+    pool.clear()
+    assert len(pool) == 0
+    assert not any(h.isopen() for h in handles)
+
+
+def test_pool_closes_evicted_handle_on_release(files):
+    pool = DatasetPool(max_size=1)
+    with pool.dataset(files[0]) as in_use:
+        with pool.dataset(files[1]):
+            pass
+        assert in_use.isopen()
+        with NETCDF_LOCK:
+            assert in_use.variables["discharge"].shape == (10, 2)
+    assert not in_use.isopen()
+
+
+def test_pool_reopens_file_on_mtime_change(files):
+    pool = DatasetPool(max_size=2)
+    with pool.dataset(files[0]) as old:
+        with NETCDF_LOCK:
+            old_values = old.variables["discharge"][:]
+    # HDF5 refuses to truncate a file open in this process, so the new version is moved in place
+    write_discharge_file(files[0] + ".new", n_series=2, n_steps=10, seed=42)
+    os.replace(files[0] + ".new", files[0])
+    mtime = os.path.getmtime(files[0]) + 10.
+    os.utime(files[0], (mtime, mtime))
+    with pool.dataset(files[0]) as new:
+        assert new is not old
+        with NETCDF_LOCK:
+            assert (new.variables["discharge"][:] != old_values).any()
+    assert not old.isopen()
+    assert len(pool) == 1
+
+
+def test_pool_rejects_missing_file_and_bad_size(tmp_path):
+    pool = DatasetPool()
+    with pytest.raises(DatasetPoolError):
+        with pool.dataset(str(tmp_path/"missing.nc")):
+            pass
+    with pytest.raises(DatasetPoolError):
+        DatasetPool(max_size=0)
+    with pytest.raises(DatasetPoolError):
+        pool.max_size = 0
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from netCDF4 import Dataset
+
+from mst_himalaya.synthetic_data import EPSG, FORCING_FILES, write_discharge_file, write_forcing_files
+
+T0 = 946684800  # 2000-01-01
+
+
+@pytest.fixture(scope="module")
+def forcing(tmp_path_factory):
+    return write_forcing_files(str(tmp_path_factory.mktemp("forcing")), n_stations=9, n_steps=72,
+                               chunks=(24, 9), time_block=30)
+
+
+@pytest.fixture(scope="module")
+def discharge(tmp_path_factory):
+    filename = str(tmp_path_factory.mktemp("discharge")/"discharge.nc")
+    return filename, write_discharge_file(filename, n_series=3, n_steps=30)
+
+
+def test_forcing_files_have_station_layout(forcing):
+    assert set(forcing) == set(FORCING_FILES)
+    for name, filename in forcing.items():
+        with Dataset(filename) as ds:
+            assert ds.variables[name].dimensions == ("time", "station")
+            assert ds.variables[name].shape == (72, 9)
+            assert ds.variables[name].chunking() == [24, 9]
+            assert ds.variables["crs"].epsg_code == "EPSG:{}".format(EPSG)
+            assert list(ds.variables["series_name"][:]) == list(range(9))
+            assert np.array_equal(ds.variables["time"][:], np.arange(72))
+            assert np.isfinite(ds.variables[name][:]).all()
+
+
+def test_discharge_file_names_series(discharge):
+    filename, names = discharge
+    assert names == ["gauge_0", "gauge_1", "gauge_2"]
+    with Dataset(filename) as ds:
+        assert list(ds.variables["series_name"][:]) == names
+        assert ds.variables["discharge"].shape == (30, 3)
+        assert (ds.variables["discharge"][:] > 0).all()
+
+
+def test_forcing_files_read_by_cf_data_repos(forcing):
+    pytest.importorskip("shyft.time_series", exc_type=ImportError)
+    from shyft.time_series import UtcPeriod
+    from mst_himalaya.wfde5_cf_geo_ts_repository import CFDataRepos
+    period = UtcPeriod(T0 + 3600, T0 + 48*3600)
+    with CFDataRepos(EPSG, forcing["temperature"], padding=0.) as repo:
+        geo_ts = repo.get_timeseries(["temperature"], period)
+    assert len(geo_ts["temperature"]) == 9
+    for source in geo_ts["temperature"]:
+        assert source.ts.total_period().contains(period)
+        assert np.isfinite(source.ts.values.to_numpy()).all()
+
+
+def test_discharge_file_read_by_cf_ts_repository(discharge):
+    pytest.importorskip("shyft.time_series", exc_type=ImportError)
+    from shyft.time_series import UtcPeriod
+    from mst_himalaya.wfde5_cf_ts_repository import CFTsRepository
+    filename, names = discharge
+    with Dataset(filename) as ds:
+        expected = ds.variables["discharge"][:]
+    tsv = CFTsRepository(filename, "discharge").read(names, UtcPeriod(T0, T0 + 29*86400))
+    assert sorted(tsv) == names
+    for j, name in enumerate(names):
+        assert np.allclose(tsv[name].values.to_numpy(), expected[:len(tsv[name].values), j])
@@ -0,0 +1,90 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("shyft.time_series", exc_type=ImportError)
+from shyft.time_series import UtcPeriod
+
+from mst_himalaya.synthetic_data import write_discharge_file
+from mst_himalaya.target_cache import TargetSeriesCache, repository_hash
+
+T0 = 946684800  # 2000-01-01
+DAY = 86400
+READ_PERIOD = UtcPeriod(T0, T0 + 365*DAY)
+
+
+class _Repository:
+    def __init__(self, filenames, var_name="discharge"):
+        self.filenames = filenames
+        self.var_name = var_name
+
+
+class _OtherRepository(_Repository):
+    pass
+
+
+def _rewrite(filename, seed):
+    write_discharge_file(filename, n_series=2, n_steps=400, seed=seed)
+    # keep the mtime moving also on file systems with coarse timestamps
+    mtime = os.path.getmtime(filename) + seed
+    os.utime(filename, (mtime, mtime))
+
+
+@pytest.fixture
+def discharge_file(tmp_path):
+    filename = str(tmp_path/"discharge.nc")
+    _rewrite(filename, 1)
+    return filename
+
+
+def _key(repository, read_period=READ_PERIOD):
+    return TargetSeriesCache.make_key("gauge_0", repository_hash(repository), T0, DAY, 365, read_period)
+
+
+def test_cached_values_are_read_only_and_shared(discharge_file):
+    cache = TargetSeriesCache()
+    key = _key(_Repository([discharge_file]))
+    assert cache.get(key) is None
+    stored = cache.put(key, [1., 2., 3.])
+    assert cache.get(key) is stored
+    assert not stored.flags.writeable
+
+
+def test_changed_file_invalidates_key(discharge_file, tmp_path):
+    cache = TargetSeriesCache()
+    repository = _Repository([discharge_file])
+    old_key = _key(repository)
+    cache.put(old_key, np.arange(365.), str(tmp_path/"cache"))
+    assert _key(repository) == old_key
+    _rewrite(discharge_file, 2)
+    new_key = _key(repository)
+    assert new_key != old_key
+    assert cache.get(new_key, str(tmp_path/"cache")) is None
+    cache.clear()
+    assert np.array_equal(cache.get(old_key, str(tmp_path/"cache")), np.arange(365.))
+
+
+def test_key_depends_on_read_period_and_axis(discharge_file):
+    repository = _Repository([discharge_file])
+    key = _key(repository)
+    assert _key(repository, UtcPeriod(T0, T0 + 366*DAY)) != key
+    assert TargetSeriesCache.make_key("gauge_0", repository_hash(repository), T0, DAY, 364, READ_PERIOD) != key
+    assert TargetSeriesCache.make_key("gauge_1", repository_hash(repository), T0, DAY, 365, READ_PERIOD) != key
+
+
+def test_repository_hash_covers_every_file(discharge_file, tmp_path):
+    other = str(tmp_path/"other.nc")
+    _rewrite(other, 3)
+    both = repository_hash(_Repository([discharge_file, other]))
+    assert both == repository_hash(_Repository([other, discharge_file]))
+    assert both != repository_hash(_Repository([discharge_file]))
+    _rewrite(other, 4)
+    assert repository_hash(_Repository([discharge_file, other])) != both
+    assert repository_hash(object()) is None
+
+
+def test_repository_hash_depends_on_variable_and_type(discharge_file):
+    discharge = repository_hash(_Repository([discharge_file]))
+    assert repository_hash(_Repository([discharge_file], "catchment_id")) != discharge
+    assert repository_hash(_OtherRepository([discharge_file])) != discharge
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("shyft.time_series", exc_type=ImportError)
+from shyft.time_series import UtcPeriod
+from shyft.hydrology.repository.netcdf.utils import _make_time_slice
+
+from mst_himalaya.time_axis_cache import detect_fixed_dt, make_time_slice
+
+T0 = 946684800  # 2000-01-01
+DT = 3600
+TIME = T0 + DT*np.arange(48, dtype=np.int64)
+
+
+class SliceError(Exception):
+    pass
+
+
+def _slice_or_error(make, *args):
+    try:
+        return make(*args)
+    except SliceError:
+        return SliceError
+
+
+@pytest.mark.parametrize("start, end", [
+    (T0, T0 + 47*DT),  # whole file
+    (T0, T0 + 10*DT),  # on the grid
+    (T0 + 1800, T0 + 10*DT + 1800),  # between time points
+    (T0 + 5*DT, T0 + 46*DT + 1),
+    (T0 + 46*DT, T0 + 47*DT),  # last step
+    (T0 - 1, T0 + 10*DT),  # starts before the file
+    (T0 + 47*DT, T0 + 48*DT),  # starts at the last time point
+    (T0 + 10*DT, T0 + 47*DT + 1),  # ends after the file
+])
+def test_make_time_slice_matches_shyft(start, end):
+    period = UtcPeriod(start, end)
+    expected = _slice_or_error(_make_time_slice, TIME, period, SliceError)
+    assert _slice_or_error(make_time_slice, TIME, DT, period, SliceError) == expected
+
+
+def test_make_time_slice_without_period_matches_shyft():
+    assert make_time_slice(TIME, DT, None, SliceError) == _make_time_slice(TIME, None, SliceError)
+
+
+def test_make_time_slice_falls_back_on_irregular_time():
+    time = np.concatenate([TIME[:10], TIME[11:]])
+    assert detect_fixed_dt(time) is None
+    period = UtcPeriod(T0 + 5*DT + 1, T0 + 20*DT)
+    assert make_time_slice(time, None, period, SliceError) == _make_time_slice(time, period, SliceError)
+
+
+def test_detect_fixed_dt():
+    assert detect_fixed_dt(TIME) == DT
+    assert detect_fixed_dt(TIME[:1]) is None
+    assert detect_fixed_dt(TIME[::-1]) is None
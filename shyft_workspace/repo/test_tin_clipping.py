@@ -0,0 +1,33 @@
+from os import path
+
+import h5py
+import numpy as np
+import pytest
+from shapely.geometry import Polygon, box
+
+pytest.importorskip("shyft.hydrology", exc_type=ImportError)
+from mst_himalaya.cf_region_model_repository_tin import faces_in_polygon
+
+TIN = path.join(path.dirname(path.abspath(__file__)), "..", "shyft-data", "budhi_gandaki", "tin_archive",
+                "narayani-cid-10-small.h5")
+
+
+@pytest.fixture(scope="module")
+def vertices():
+    with h5py.File(TIN, "r") as f:
+        return f["tin/points"][()][f["tin/faces"][()]]
+
+
+def _polygons(vertices):
+    xy = vertices[:, :, :2]
+    lower, upper = xy.min(axis=(0, 1)), xy.max(axis=(0, 1))
+    mid = (lower + upper)/2
+    yield box(lower[0], lower[1], mid[0], mid[1])  # south west quarter
+    yield Polygon([(lower[0], lower[1]), (upper[0], lower[1]), (mid[0], upper[1])])
+    yield box(upper[0] + 1., upper[1] + 1., upper[0] + 2., upper[1] + 2.)  # outside the mesh
+
+
+def test_faces_in_polygon_matches_per_face_test(vertices):
+    for polygon in _polygons(vertices):
+        expected = [Polygon(v[:, :2]).intersects(polygon) for v in vertices]
+        assert np.array_equal(faces_in_polygon(vertices, polygon), expected)
@@ -0,0 +1,65 @@
+from os import path
+
+import h5py
+import numpy as np
+import pytest
+
+from mst_himalaya.tin_decimation import TinDecimationError, decimate
+
+TIN = path.join(path.dirname(path.abspath(__file__)), "..", "shyft-data", "budhi_gandaki", "tin_archive",
+                "narayani-cid-10-largest.h5")
+
+
+@pytest.fixture(scope="module")
+def tin():
+    with h5py.File(TIN, "r") as f:
+        return f["tin/points"][:], f["tin/faces"][:], f["tin/face_fields/cover_type"][:]
+
+
+def _cover_areas(points, faces, cover_type):
+    p = points[faces]
+    area = 0.5*np.abs((p[:, 1, 0] - p[:, 0, 0])*(p[:, 2, 1] - p[:, 0, 1]) -
+                      (p[:, 2, 0] - p[:, 0, 0])*(p[:, 1, 1] - p[:, 0, 1]))
+    return {c: area[cover_type == c].sum() for c in np.unique(cover_type)}
+
+
+@pytest.mark.parametrize("target_faces", [2000, 911])
+def test_decimate_meets_face_budget_and_keeps_cover_areas(tin, target_faces):
+    points, faces, cover_type = tin
+    d_points, d_faces, d_cover_type = decimate(points, faces, cover_type, target_faces=target_faces,
+                                               max_area_change=0.02)
+    assert len(d_faces) <= target_faces
+    assert len(d_faces) == len(d_cover_type)
+    assert d_faces.max() < len(d_points)
+    before = _cover_areas(points, faces, cover_type)
+    after = _cover_areas(d_points, d_faces, d_cover_type)
+    assert set(after) == set(before)
+    for c, area in before.items():
+        assert abs(after[c] - area) <= 0.02*area + 1e-6
+
+
+def test_decimate_raises_on_unreachable_budget(tin):
+    with pytest.raises(TinDecimationError):
+        decimate(*tin, target_faces=100, max_area_change=0.02)
+
+
+def test_decimate_within_vertical_tolerance(tin):
+    points, faces, cover_type = tin
+    d_points, d_faces, _ = decimate(points, faces, cover_type, tolerance=50.0)
+    assert len(d_faces) < len(faces)
+    tri = d_points[d_faces]
+    a, b, c = tri[:, 0, :2], tri[:, 1, :2], tri[:, 2, :2]
+    det = (b[:, 0] - a[:, 0])*(c[:, 1] - a[:, 1]) - (c[:, 0] - a[:, 0])*(b[:, 1] - a[:, 1])
+    covered = 0
+    for x, y, z in points[np.unique(faces)]:
+        l1 = ((b[:, 0] - x)*(c[:, 1] - y) - (c[:, 0] - x)*(b[:, 1] - y))/det
+        l2 = ((c[:, 0] - x)*(a[:, 1] - y) - (a[:, 0] - x)*(c[:, 1] - y))/det
+        l3 = 1.0 - l1 - l2
+        inside = np.minimum(np.minimum(l1, l2), l3) >= -1e-9
+        if not inside.any():
+            continue  # outline collapses leave a few vertices just outside the mesh
+        covered += 1
+        zi = l1*tri[:, 0, 2] + l2*tri[:, 1, 2] + l3*tri[:, 2, 2]
+        # input TINs contain overlapping faces, the vertex lies on the closest of them
+        assert np.abs(zi[inside] - z).min() <= 50.0 + 1e-6
+    assert covered >= 0.95*len(np.unique(faces))
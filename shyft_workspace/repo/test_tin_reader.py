@@ -0,0 +1,64 @@
+from os import path
+import shutil
+
+import h5py
+import numpy as np
+import pytest
+
+pytest.importorskip("shyft.hydrology", exc_type=ImportError)
+from mst_himalaya.cf_region_model_repository_tin import (CFRegionModelRepositoryError, TinReader,
+                                                         land_cover_index, read_tin)
+
+TIN_ARCHIVE = path.join(path.dirname(path.abspath(__file__)), "..", "shyft-data", "budhi_gandaki", "tin_archive")
+TINS = ["narayani-cid-10-small.h5", "narayani-cid-10-largest.h5"]
+
+
+def _read_h5(filename):
+    with h5py.File(filename, "r") as f:
+        tin = f["tin"]
+        return (tin["points"][()], tin["faces"][()], tin["face_fields/cover_color"][()],
+                tin["face_fields/cover_type"][()], f["information/land_covers"][()])
+
+
+@pytest.mark.parametrize("name", TINS)
+@pytest.mark.parametrize("chunk_size", [1, 97, 65536])
+def test_vertices_match_naive_gather(name, chunk_size):
+    filename = path.join(TIN_ARCHIVE, name)
+    points, faces, _, cover_type, _ = _read_h5(filename)
+    with TinReader(filename, chunk_size=chunk_size) as tin:
+        assert np.array_equal(tin.vertices(), points[faces])
+        assert np.array_equal(tin.cover_type(), cover_type)
+
+
+def test_read_tin_matches_naive_gather():
+    filename = path.join(TIN_ARCHIVE, TINS[0])
+    points, faces, _, cover_type, _ = _read_h5(filename)
+    vertices, read_cover_type = read_tin(filename)
+    assert np.array_equal(vertices, points[faces])
+    assert np.array_equal(read_cover_type, cover_type)
+
+
+def test_cover_type_from_colour_matches_stored_codes(tmp_path):
+    filename = str(tmp_path/"colour_only.h5")
+    shutil.copy(path.join(TIN_ARCHIVE, TINS[1]), filename)
+    with h5py.File(filename, "r+") as f:
+        cover_type = f["tin/face_fields/cover_type"][()]
+        del f["tin/face_fields/cover_type"]
+    with TinReader(filename, chunk_size=1000) as tin:
+        assert np.array_equal(tin.cover_type(), cover_type)
+
+
+def test_land_cover_index_matches_naive_lookup():
+    _, _, cover_color, _, land_covers = _read_h5(path.join(TIN_ARCHIVE, TINS[1]))
+    naive = []
+    for colour in np.round(cover_color*255).astype(int):
+        naive.append(next(i for i, (_, _, r, g, b) in enumerate(land_covers) if (r, g, b) == tuple(colour)))
+    assert np.array_equal(land_cover_index(cover_color, land_covers), naive)
+
+
+def test_land_cover_index_first_match_wins_and_unknown_raises():
+    land_covers = [(1, b"a", 10, 20, 30), (2, b"b", 0, 0, 0), (3, b"c", 10, 20, 30)]
+    colours = np.array([[10, 20, 30], [0, 0, 0]])/255.
+    assert list(land_cover_index(colours, land_covers)) == [0, 1]
+    with pytest.raises(CFRegionModelRepositoryError):
+        land_cover_index(np.array([[1., 1., 1.]]), land_covers)
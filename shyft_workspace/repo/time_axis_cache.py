@@ -0,0 +1,104 @@
+"""
+Per file cache of decoded netCDF time vectors.
+
+WFDE5 forcing and the discharge series are strictly hourly or daily, so besides
+caching the decoded vector we detect a fixed interval. With a fixed interval the
+period -> index lookup is plain arithmetic and the repositories can hand Shyft a
+fixed-dt TimeAxis, which is much cheaper to interpolate and accumulate over than a
+point TimeAxis.
+"""
+
+from os import path
+
+import numpy as np
+from shyft.time_series import TimeAxis, UtcPeriod, UtcTimeVector
+from shyft.hydrology.repository.netcdf.time_conversion import convert_netcdf_time
+from shyft.hydrology.repository.netcdf.utils import _make_time_slice
+
+from mst_himalaya.cache_utils import LRUCache
+
+
+def detect_fixed_dt(time):
+    """Return the common step of time in seconds, or None if spacing is not uniform."""
+    if len(time) < 2:
+        return None
+    dt = int(time[1] - time[0])
+    if dt <= 0 or not np.all(np.diff(time) == dt):
+        return None
+    return dt
+
+
+def make_time_slice(time, dt, utc_period, err):
+    """
+    Same contract as shyft's _make_time_slice, i.e. a slice of time covering
+    utc_period, but computed arithmetically when the time vector has a fixed step dt.
+    """
+    if dt is None:
+        return _make_time_slice(time, utc_period, err)
+    n = len(time)
+    t0 = int(time[0])
+    if utc_period is None:
+        utc_period = UtcPeriod(t0, int(time[-1]))
+    start, end = int(utc_period.start), int(utc_period.end)
+    idx_min = (start - t0)//dt  # last index with time <= start
+    idx_max = -((t0 - end)//dt)  # first index with time >= end, i.e. ceil((end - t0)/dt)
+    if start < t0 or idx_min >= n - 1:
+        raise err("The earliest time in repository ({}) is later than the start of the period for which data is "
+                  "requested ({})".format(t0, start))
+    if idx_max <= 0 or idx_max >= n:
+        raise err("The latest time in repository ({}) is earlier than the end of the period for which data is "
+                  "requested ({})".format(int(time[-1]), end))
+    issubset = True if idx_max < n - 1 else False
+    return slice(idx_min, idx_max + 1), issubset
+
+
+def make_time_axis(time, dt, end=None):
+    """
+    TimeAxis for the points in time, fixed-dt when possible.
+
+    Parameters
+    ----------
+    time: np.ndarray
+        start of each interval
+    dt: int or None
+        fixed step as returned by detect_fixed_dt
+    end: int, optional
+        end of the last interval; when None the last point of time closes the axis
+    """
+    if dt is not None:
+        n = len(time) if end is not None else len(time) - 1
+        return TimeAxis(int(time[0]), dt, n)
+    if end is not None:
+        return TimeAxis(UtcTimeVector.from_numpy(time.astype(int)), int(end))
+    return TimeAxis(UtcTimeVector.from_numpy(time.astype(int)))
+
+
+class TimeAxisCache:
+    """
+    LRU cache of (decoded time vector, fixed dt or None) keyed by (filename, mtime).
+    """
+
+    def __init__(self, max_size=64):
+        self._entries = LRUCache(max_size)
+
+    def get(self, filename, nc_time):
+        """
+        Decoded time of the netCDF variable nc_time belonging to filename.
+
+        The returned array is shared and read-only.
+        """
+        filename = path.abspath(filename)
+        key = filename, path.getmtime(filename)
+
+        def decode():
+            time = np.asarray(convert_netcdf_time(nc_time.units, nc_time))
+            time.setflags(write=False)
+            return time, detect_fixed_dt(time)
+
+        return self._entries.get_or_compute(key, decode)
+
+    def clear(self):
+        self._entries.clear()
+
+
+time_axis_cache = TimeAxisCache()
@@ -0,0 +1,343 @@
+"""
+Decimation of rasputin TINs to a face budget or an error tolerance.
+
+The mesh is simplified by half-edge collapses in order of their quadric error
+(Garland and Heckbert), so the kept vertices are original DEM samples. Vertices
+inside one land cover collapse onto any neighbour; vertices on a land cover
+boundary or on the mesh outline only collapse along that boundary or outline,
+and only non-manifold vertices are pinned. A collapse is rejected when it
+folds a face, breaks the mesh topology or moves the area of a land cover by more
+than max_area_change. Boundary and outline edges add constraint planes to the
+quadrics, so the tolerance bounds both the surface and the boundary deviation.
+
+Collapses run in python, so decimating large TINs takes a while; results are
+cached in memory and, when a cache directory is given, as .npz files next to
+the compiled cell geometry.
+"""
+
+import heapq
+from os import path
+
+import numpy as np
+
+from mst_himalaya.cache_utils import LRUCache, atomic_write, file_hash, key_digest
+
+# part of the cache keys, bump when the decimation changes its results
+DECIMATION_VERSION = 2
+
+# weight of the land cover area a collapse moves, relative to the quadric error, in the collapse order
+AREA_WEIGHT = 0.1
+
+
+class TinDecimationError(Exception):
+    pass
+
+
+def _signed_area(points, faces):
+    p = points[faces]
+    return ((p[:, 1, 0] - p[:, 0, 0])*(p[:, 2, 1] - p[:, 0, 1]) -
+            (p[:, 2, 0] - p[:, 0, 0])*(p[:, 1, 1] - p[:, 0, 1]))
+
+
+def _plane_quadrics(normals, origins):
+    """(n, 4, 4) quadrics of the planes with unit normals through origins."""
+    planes = np.column_stack([normals, -(normals*origins).sum(axis=1)])
+    return planes[:, :, None]*planes[:, None, :]
+
+
+def _quadrics(points, faces, cover_type):
+    """
+    Per vertex quadric of the planes of its faces and of the constraint planes
+    standing on the outline and land cover boundary edges next to it.
+    """
+    p = points[faces]
+    normals = np.cross(p[:, 1] - p[:, 0], p[:, 2] - p[:, 0])
+    length = np.linalg.norm(normals, axis=1)
+    normals = np.divide(normals, length[:, None], out=np.zeros_like(normals), where=length[:, None] > 0)
+    q = np.zeros((len(points), 4, 4))
+    face_q = _plane_quadrics(normals, p[:, 0])
+    for k in range(3):
+        np.add.at(q, faces[:, k], face_q)
+
+    # feature edges: on one face only, or between faces of different land cover
+    edges = faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2)
+    edge_face = np.repeat(np.arange(len(faces)), 3)
+    key = np.sort(edges, axis=1)
+    _, inverse, counts = np.unique(key, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.ravel()
+    n_covers = np.zeros(len(counts), dtype=np.int64)
+    first_cover = np.full(len(counts), -1, dtype=np.int64)
+    first_cover[inverse[::-1]] = np.asarray(cover_type)[edge_face[::-1]]
+    np.add.at(n_covers, inverse, np.asarray(cover_type)[edge_face] != first_cover[inverse])
+    feature = (counts[inverse] == 1) | (n_covers[inverse] > 0)
+    a, b = points[edges[feature, 0]], points[edges[feature, 1]]
+    side = np.cross(b - a, normals[edge_face[feature]])
+    length = np.linalg.norm(side, axis=1)
+    ok = length > 0
+    side_q = _plane_quadrics(side[ok]/length[ok, None], a[ok])
+    np.add.at(q, edges[feature][ok, 0], side_q)
+    np.add.at(q, edges[feature][ok, 1], side_q)
+    return q
+
+
+class _EdgeCollapse:
+    """Mutable mesh state of one decimation run."""
+
+    def __init__(self, points, faces, cover_type, max_area_change, track_error):
+        centred = points - points.mean(axis=0)  # keeps the quadrics well conditioned
+        self._h = np.column_stack([centred, np.ones(len(points))])
+        self._q = _quadrics(centred, faces, cover_type)
+        self._p = centred.tolist()
+        self.faces = faces.tolist()
+        self._cover = np.asarray(cover_type).tolist()
+        self.alive = [True]*len(self.faces)
+        self.n_faces = len(self.faces)
+        self._vf = [set() for _ in range(len(points))]
+        for f, face in enumerate(self.faces):
+            for v in face:
+                self._vf[v].add(f)
+        area = _signed_area(centred, faces)
+        self._sign = np.where(area < 0, -1.0, 1.0).tolist()
+        self._face_area = np.abs(area).tolist()
+        self._area = {}
+        for c, a in zip(self._cover, np.abs(area).tolist()):
+            self._area[c] = self._area.get(c, 0.0) + a
+        self._area0 = dict(self._area)
+        self._total = sum(self._area0.values())
+        self._eps = 1e-12*self._total
+        self._max_area_change = max_area_change
+        # removed vertices lying in each face, to measure the vertical error of the simplified surface
+        self._inside = [[] for _ in self.faces] if track_error else None
+
+    def _tri_area(self, a, b, c):
+        (ax, ay, _), (bx, by, _), (cx, cy, _) = self._p[a], self._p[b], self._p[c]
+        return (bx - ax)*(cy - ay) - (cx - ax)*(by - ay)
+
+    def _neighbours(self, u):
+        return {w for f in self._vf[u] for w in self.faces[f]} - {u}
+
+    def targets(self, u):
+        """
+        Vertices u may collapse onto: any neighbour inside a land cover, otherwise the
+        neighbours along a land cover boundary, and along the outline for outline vertices.
+        """
+        nb = self._neighbours(u)
+        boundary, outline = [], []
+        for w in nb:
+            shared = self._vf[u] & self._vf[w]
+            if len(shared) == 1:
+                outline.append(w)
+            elif len(shared) != 2:
+                return ()  # non-manifold, pinned
+            elif len({self._cover[f] for f in shared}) > 1:
+                boundary.append(w)
+        if outline:
+            return outline
+        if boundary:
+            return boundary
+        return nb
+
+    def _quadric_error(self, u, v):
+        h = self._h[v]
+        return max(float(h @ (self._q[u] + self._q[v]) @ h), 0.0)
+
+    def check(self, u, v, neighbours_u=None):
+        """Land cover area changes of collapsing u onto v, None when the collapse folds or breaks the mesh."""
+        vf_u = self._vf[u]
+        shared = vf_u & self._vf[v]
+        if not shared:
+            return None
+        # link condition: the common neighbours of u and v are exactly the tips of their shared faces
+        tips = {w for f in shared for w in self.faces[f]} - {u, v}
+        if neighbours_u is None:
+            neighbours_u = self._neighbours(u)
+        if neighbours_u & self._neighbours(v) != tips:
+            return None
+        delta = {}
+        for f in vf_u:
+            if f in shared:
+                new = 0.0
+            else:
+                a, b, c = self.faces[f]
+                new = self._tri_area(v if a == u else a, v if b == u else b, v if c == u else c)*self._sign[f]
+                if new <= self._eps:
+                    return None
+            cover = self._cover[f]
+            delta[cover] = delta.get(cover, 0.0) + new - self._face_area[f]
+        for cover, d in delta.items():
+            if abs(self._area[cover] + d - self._area0[cover]) > self._max_area_change*self._area0[cover] + self._eps:
+                return None
+        return delta
+
+    def vertical_error(self, u, v):
+        """
+        (largest vertical distance of u and the removed vertices around it from the
+        surface after collapsing u onto v, face of each of those vertices after it).
+        """
+        new_faces = [(f, [v if w == u else w for w in self.faces[f]]) for f in self._vf[u] - self._vf[v]]
+        if not new_faces:
+            return np.inf, {}  # the collapse removes all faces around u
+        error = 0.0
+        located = {}
+        for i in [u] + [i for f in self._vf[u] for i in self._inside[f]]:
+            x, y, z = self._p[i]
+            best = None
+            for f, (a, b, c) in new_faces:
+                (ax, ay, az), (bx, by, bz), (cx, cy, cz) = self._p[a], self._p[b], self._p[c]
+                det = (bx - ax)*(cy - ay) - (cx - ax)*(by - ay)
+                l1 = ((x - ax)*(cy - ay) - (cx - ax)*(y - ay))/det
+                l2 = ((bx - ax)*(y - ay) - (x - ax)*(by - ay))/det
+                inside = min(1.0 - l1 - l2, l1, l2)  # >= 0 inside, the least negative one for points off the mesh
+                if best is None or inside > best[0]:
+                    best = inside, f, az + l1*(bz - az) + l2*(cz - az)
+            error = max(error, abs(z - best[2]))
+            located.setdefault(best[1], []).append(i)
+        return error, located
+
+    def best(self, u, tolerance):
+        """(cost, v) of the cheapest allowed collapse of u within tolerance, or None."""
+        neighbours_u = self._neighbours(u)
+        best = None
+        for error, v in sorted((self._quadric_error(u, v), v) for v in self.targets(u)):
+            if best is not None and error >= best[0]:
+                break  # the area term only adds to the cost
+            delta = self.check(u, v, neighbours_u)
+            if delta is None:
+                continue
+            # area moved between land covers counts as squared distance, weighted by the share of each cover
+            moved = sum(abs(d)*self._total/self._area0[cover] for cover, d in delta.items())/len(self._area0)
+            cost = error + AREA_WEIGHT*moved
+            if (best is None or cost < best[0]) and (tolerance is None or self.vertical_error(u, v)[0] <= tolerance):
+                best = cost, v
+        return best
+
+    def collapse(self, u, v, delta):
+        if self._inside is not None:
+            _, located = self.vertical_error(u, v)
+            for f in self._vf[u]:
+                self._inside[f] = []
+        shared = self._vf[u] & self._vf[v]
+        for f in shared:
+            self.alive[f] = False
+            self.n_faces -= 1
+            for w in self.faces[f]:
+                self._vf[w].discard(f)
+        for f in self._vf[u]:
+            self.faces[f] = [v if w == u else w for w in self.faces[f]]
+            self._face_area[f] = abs(self._tri_area(*self.faces[f]))
+            self._vf[v].add(f)
+        self._vf[u] = set()
+        self._q[v] += self._q[u]
+        for cover, d in delta.items():
+            self._area[cover] += d
+        if self._inside is not None:
+            for f, removed in located.items():
+                self._inside[f] = removed
+        return self._neighbours(v) | {v}
+
+
+def decimate(points, faces, cover_type, target_faces=None, tolerance=None, max_area_change=0.02):
+    """
+    Simplify a TIN to at most target_faces faces and/or within tolerance.
+
+    Parameters
+    ----------
+    points: np.ndarray
+        (n_points, 3) vertex coordinates
+    faces: np.ndarray
+        (n_faces, 3) vertex indices
+    cover_type: np.ndarray
+        land cover code of each face
+    target_faces: int, optional
+        face budget of the result
+    tolerance: float, optional
+        largest vertical distance of any original vertex from the simplified surface,
+        in the units of points
+    max_area_change: float
+        largest relative change of the area of any land cover
+
+    Without target_faces the mesh is simplified as far as tolerance allows. With
+    target_faces simplification stops at the budget, and TinDecimationError is raised
+    when the tolerance or the area limit stop it before.
+
+    Returns
+    -------
+    points, faces, cover_type of the simplified mesh
+    """
+    points = np.asarray(points, dtype=np.float64)
+    faces = np.asarray(faces)
+    cover_type = np.asarray(cover_type)
+    if target_faces is None and tolerance is None:
+        return points, faces, cover_type
+    if target_faces is not None and target_faces >= len(faces):
+        return points, faces, cover_type
+
+    mesh = _EdgeCollapse(points, faces, cover_type, max_area_change, tolerance is not None)
+    version = [0]*len(points)
+    heap = []
+
+    def push(u):
+        version[u] += 1
+        candidate = mesh.best(u, tolerance)
+        if candidate is not None:
+            heapq.heappush(heap, (candidate[0], u, candidate[1], version[u]))
+
+    for u in range(len(points)):
+        push(u)
+    while heap and (target_faces is None or mesh.n_faces > target_faces):
+        _, u, v, ver = heapq.heappop(heap)
+        if ver != version[u]:
+            continue  # superseded by a later push
+        delta = mesh.check(u, v) if v in mesh.targets(u) else None
+        if delta is None or (tolerance is not None and mesh.vertical_error(u, v)[0] > tolerance):
+            push(u)  # the neighbourhood changed since u was queued
+            continue
+        version[u] += 1
+        for w in mesh.collapse(u, v, delta):
+            push(w)
+    if target_faces is not None and mesh.n_faces > target_faces:
+        raise TinDecimationError("Decimation stops at {} faces, above the budget of {} faces, within {}{}".format(
+            mesh.n_faces, target_faces, "land cover area change {}".format(max_area_change),
+            "" if tolerance is None else " and tolerance {}".format(tolerance)))
+
+    alive = np.flatnonzero(mesh.alive)
+    new_faces = np.array([mesh.faces[f] for f in alive], dtype=faces.dtype).reshape(-1, 3)
+    used, remap = np.unique(new_faces, return_inverse=True)
+    return points[used], remap.reshape(-1, 3).astype(faces.dtype), cover_type[alive]
+
+
+class DecimatedTinCache:
+    """
+    LRU cache of decimated (points, faces, cover_type) keyed by the source file content
+    and the decimation settings.
+    """
+
+    def __init__(self, max_size=16):
+        self._entries = LRUCache(max_size)
+
+    @staticmethod
+    def make_key(filename, target_faces, tolerance, max_area_change):
+        return file_hash(filename), target_faces, tolerance, max_area_change, DECIMATION_VERSION
+
+    @staticmethod
+    def _disk_name(cache_dir, key):
+        return path.join(cache_dir, "decimated_tin_{}.npz".format(key_digest(key)))
+
+    def get_or_compute(self, key, compute, cache_dir=None):
+        def load_or_compute():
+            filename = self._disk_name(cache_dir, key) if cache_dir is not None else None
+            if filename is not None and path.isfile(filename):
+                with np.load(filename) as f:
+                    return f["points"], f["faces"], f["cover_type"]
+            value = compute()
+            if filename is not None:
+                atomic_write(filename, lambda tmp: np.savez(tmp, points=value[0], faces=value[1], cover_type=value[2]))
+            return value
+
+        return self._entries.get_or_compute(key, load_or_compute)
+
+    def clear(self):
+        self._entries.clear()
+
+
+decimated_tin_cache = DecimatedTinCache()
@@ -1,34 +1,141 @@
 # This file is part of Shyft. Copyright 2015-2018 SiH, JFB, OS, YAS, Statkraft AS
 # See file COPYING for more details **/
 from os import path
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import numpy as np
-from netCDF4 import Dataset
 from shyft.hydrology import shyftdata_dir
-from shyft.time_series import (TimeAxis, UtcTimeVector)
+from shyft.time_series import (UtcPeriod, deltahours, DoubleVector, TimeSeries)
+from shyft.hydrology import GeoPointVector
 from shyft.hydrology.repository import interfaces
-from shyft.hydrology.repository.netcdf.time_conversion import convert_netcdf_time
-from shyft.hydrology.repository.netcdf.utils import _limit_1D, _numpy_to_geo_ts_vec, _make_time_slice, _slice_var_1D
+from shyft.hydrology.repository.netcdf.utils import (create_geo_ts_type_map, series_type, source_type_map,
+                                                     source_vector_map)
+from mst_himalaya.netcdf_pool import NETCDF_LOCK, dataset_pool
+from mst_himalaya.spatial_subset_cache import spatial_subset_cache, criteria_hash
+from mst_himalaya.proj_registry import limit_1D
+from mst_himalaya.time_axis_cache import time_axis_cache, make_time_slice, make_time_axis
 
 
 class CFDataRepositoryError(Exception):
     pass
 
-class CFDataRepos(interfaces.GeoTsRepository):
+
+def _read_var_1D(nc_var, xy_var_name, xy_slice, xy_mask, time_slice, dtype, block_bytes=4*1024*1024):
     """
-    Repository for geo located timeseries stored in netCDF files.
+    Same selection as shyft's _slice_var_1D, read in time blocks into one array of
+    dtype: masked values (fill values, missing_value, outside valid_range) become nan
+    and the station mask is only applied when it actually removes stations.
 
+    netCDF4 holds a second buffer of every read, so reading in blocks keeps the peak
+    at the size of the result plus block_bytes. NETCDF_LOCK is only held for the
+    reads of each block.
     """
+    with NETCDF_LOCK:
+        dims = nc_var.dimensions
+        var_shape = nc_var.shape
+    data_slice = len(dims)*[slice(None)]
+    data_slice[dims.index(xy_var_name)] = xy_slice
+    if "time" not in dims:
+        with NETCDF_LOCK:
+            block = nc_var[tuple(data_slice)]
+        return _compress_stations(np.ma.filled(block.astype(dtype, copy=False), np.nan),
+                                  dims.index(xy_var_name), xy_slice, xy_mask)
+    t_axis = dims.index("time")
+    t_start, t_stop, _ = time_slice.indices(var_shape[t_axis])
+    shape = [len(range(*s.indices(n))) for s, n in zip(data_slice, var_shape)]
+    shape[t_axis] = max(t_stop - t_start, 0)
+    arr = np.empty(shape, dtype=dtype)
+    step = max(1, block_bytes//max(arr.nbytes//max(shape[t_axis], 1), 1))
+    out_slice = len(dims)*[slice(None)]
+    for start in range(t_start, t_stop, step):
+        stop = min(start + step, t_stop)
+        data_slice[t_axis] = slice(start, stop)
+        out_slice[t_axis] = slice(start - t_start, stop - t_start)
+        with NETCDF_LOCK:
+            block = nc_var[tuple(data_slice)]
+        arr[tuple(out_slice)] = np.ma.filled(block.astype(dtype, copy=False), np.nan)
+    return _compress_stations(arr, dims.index(xy_var_name), xy_slice, xy_mask)
+
+
+def _compress_stations(arr, axis, xy_slice, xy_mask):
+    sub_mask = xy_mask[xy_slice]
+    if not sub_mask.all():
+        arr = arr.compress(sub_mask, axis=axis)
+    return arr
+
+
+def _numpy_to_geo_ts_vec(data, x, y, z, err):
+    """
+    shyft's _numpy_to_geo_ts_vec for (time, series) arrays.
+
+    C contiguous float64 arrays are handed to Shyft whole. Other arrays, float32 or
+    strided views such as memory map slices, are copied one series at a time so no
+    float64 copy of the whole array is made.
+    """
+    geo_pts = GeoPointVector.create_from_x_y_z(*[DoubleVector.from_numpy(arr) for arr in [x, y, z]])
+    geo_ts = {}
+    for key, (arr, ta) in data.items():
+        if arr.ndim != 2:
+            raise err("Numpy array to be converted to shyft GeoTsVector must be (time, series), got ndim {}".format(
+                arr.ndim))
+        if arr.dtype == np.float64 and arr.flags.c_contiguous:
+            geo_ts[key] = create_geo_ts_type_map[key](ta, geo_pts, arr.transpose(), series_type[key])
+            continue
+        source_vector = source_vector_map[key]()
+        for j in range(arr.shape[1]):
+            values = DoubleVector.from_numpy(np.ascontiguousarray(arr[:, j], dtype=np.float64))
+            source_vector.append(source_type_map[key](geo_pts[j], TimeSeries(ta, values, series_type[key])))
+        geo_ts[key] = source_vector
+    return geo_ts
+
 
-    def __init__(self, epsg, filename, padding=5000.):
-        filename = path.expandvars(filename)
+def _diff_in_place(a, block=4096):
+    """
+    a[1:] = a[1:] - a[:-1] along the first axis without allocating a full temporary.
+
+    Walks backwards in blocks so the rows still needed as subtrahend are untouched,
+    keeping numpy's overlap buffering bounded to one block.
+    """
+    stop = len(a)
+    while stop > 1:
+        start = max(1, stop - block)
+        a[start:stop] -= a[start - 1:stop - 1]
+        stop = start
+    return a[1:]
+
+
+def _resolve_filename(filename):
+    filename = path.expandvars(filename)
+
+    if not path.isabs(filename):
+        # Relative paths will be prepended the data_dir
+        filename = path.join(shyftdata_dir, filename)
+    if not path.isfile(filename):
+        raise CFDataRepositoryError("No such file '{}'".format(filename))
+    return filename
+
+
+class CFDataRepos(interfaces.GeoTsRepository):
+    """
+    Repository for geo located timeseries stored in netCDF files.
 
-        if not path.isabs(filename):
-            # Relative paths will be prepended the data_dir
-            filename = path.join(shyftdata_dir, filename)
-        if not path.isfile(filename):
-            raise CFDataRepositoryError("No such file '{}'".format(filename))
+    """
 
-        self._filename = filename
+    def __init__(self, epsg, filename, padding=5000., subset_cache_dir=None, dtype="float64",
+                 prefetch=False, prefetch_memory_mb=1024.):
+        self._filename = _resolve_filename(filename)
+        # with prefetch on, the period following each request is read on a background thread
+        self._prefetch = prefetch
+        self._prefetch_bytes = prefetch_memory_mb*1024*1024
+        self._prefetch_lock = threading.Lock()
+        self._prefetch_executor = None
+        self._prefetched = None  # (key, future)
+        self._last_start = None
+        # float32 halves the size of the read buffers; series are widened one at a time at the Shyft handoff
+        self._dtype = np.dtype(dtype)
+        if self._dtype not in (np.float32, np.float64):
+            raise CFDataRepositoryError("dtype must be float32 or float64, got '{}'".format(dtype))
+        self._subset_cache_dir = path.expandvars(subset_cache_dir) if subset_cache_dir else None
         self.allow_subset = True  # allow_subset
         self.shyft_cs = f"+init=EPSG:{epsg}"
         self._padding = padding
@@ -45,88 +152,263 @@ class CFDataRepos(interfaces.GeoTsRepository):
 
         self._shift_fields = ("precipitation_amount_acc",
                               "integral_of_surface_downwelling_shortwave_flux_in_air_wrt_time")
+
     def get_timeseries(self, input_source_types, utc_period, geo_location_criteria=None):
         """
         see interfaces.GeoTsRepository
         """
+        if not self._prefetch:
+            geo = self._geometry(utc_period, geo_location_criteria)
+            return self._read_block(geo, input_source_types)
+
+        key = self._prefetch_key(input_source_types, utc_period, geo_location_criteria)
+        result = self._take_prefetched(key)
+        if result is None:
+            geo = self._geometry(utc_period, geo_location_criteria)
+            result = self._read_block(geo, input_source_types)
+        self._schedule_next(input_source_types, utc_period, geo_location_criteria)
+        return result
+
+    @staticmethod
+    def _prefetch_key(input_source_types, utc_period, geo_location_criteria):
+        return (tuple(sorted(input_source_types)), int(utc_period.start), int(utc_period.end),
+                criteria_hash(geo_location_criteria))
+
+    def _take_prefetched(self, key):
+        with self._prefetch_lock:
+            prefetched, self._prefetched = self._prefetched, None
+        if prefetched is None or prefetched[0] != key:
+            return None
+        # a failed prefetch raises here, for the request it was made for, a skipped one returns None
+        return prefetched[1].result()
+
+    def _schedule_next(self, input_source_types, utc_period, geo_location_criteria):
+        """
+        Start reading the period expected next: shifted by the same step as the last
+        two requests (rolling forecasts), or by the period length (consecutive segments).
+        """
+        start, end = int(utc_period.start), int(utc_period.end)
+        step = start - self._last_start if self._last_start is not None and start > self._last_start else end - start
+        self._last_start = start
+        next_period = UtcPeriod(start + step, end + step)
+        key = self._prefetch_key(input_source_types, next_period, geo_location_criteria)
+        with self._prefetch_lock:
+            if self._prefetch_executor is None:
+                self._prefetch_executor = ThreadPoolExecutor(max_workers=1)
+            self._prefetched = key, self._prefetch_executor.submit(
+                self._prefetch_block, input_source_types, next_period, geo_location_criteria)
+
+    def _prefetch_block(self, input_source_types, utc_period, geo_location_criteria):
+        """
+        Read a block on the prefetch thread, geometry included. Returns None when the
+        period is not covered by the data or the block exceeds the prefetch budget, the
+        request then reads it itself.
+        """
+        try:
+            geo = self._geometry(utc_period, geo_location_criteria)
+        except CFDataRepositoryError:
+            return None
+        n_time = geo["time_slice"].stop - geo["time_slice"].start + 1
+        # raw read plus the Shyft copy, for each requested type
+        if 2*8*n_time*len(geo["x"])*len(input_source_types) > self._prefetch_bytes:
+            return None
+        return self._read_block(geo, input_source_types)
+
+    def close(self):
+        """Stop the prefetch thread, a prefetch that has not started yet is dropped."""
+        with self._prefetch_lock:
+            executor, self._prefetch_executor = self._prefetch_executor, None
+            self._prefetched = None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        if hasattr(self, "_prefetch_lock"):  # __init__ may have failed before
+            self.close()
+
+    def iter_timeseries(self, input_source_types, utc_period, geo_location_criteria=None,
+                        block=deltahours(24*365)):
+        """
+        Generator over consecutive time blocks of utc_period, so long periods can be
+        run chunk by chunk with bounded memory.
+
+        Coordinates and the spatial subset are resolved once. Each block is read with
+        the same time slicing as get_timeseries, i.e. extended to cover the block and
+        with the extra step needed for de-accumulating fields like
+        precipitation_amount_acc.
+
+        Parameters
+        ----------
+        input_source_types: list
+            see interfaces.GeoTsRepository
+        utc_period: UtcPeriod
+            total period to iterate over
+        geo_location_criteria: shapely geometry, optional
+            see interfaces.GeoTsRepository
+        block: int
+            length of each block in seconds, default one year
+
+        Yields
+        ------
+        (UtcPeriod, dict) with the block period and its geo_ts result
+
+        With prefetch enabled the next block is read while the current one is in use,
+        so at most two blocks are held in memory.
+        """
+        block = int(block)
+        if block <= 0:
+            raise CFDataRepositoryError("block must be a positive number of seconds, got {}".format(block))
+        geo = self._geometry(utc_period, geo_location_criteria)
+        start, end = int(utc_period.start), int(utc_period.end)
+        periods = [UtcPeriod(t, min(t + block, end)) for t in range(start, end, block)]
+
+        def read(period):
+            time_slice, issubset = make_time_slice(geo["time"], geo["dt"], period, CFDataRepositoryError)
+            return self._read_block(dict(geo, time_slice=time_slice, issubset=issubset), input_source_types)
 
-        with Dataset(self._filename) as dataset:
-            return self._get_data_from_dataset(dataset, input_source_types,
-                                               utc_period, geo_location_criteria)
+        if not self._prefetch:
+            for period in periods:
+                yield period, read(period)
+            return
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(read, periods[0]) if periods else None
+            for i, period in enumerate(periods):
+                result = future.result()
+                if i + 1 < len(periods):
+                    future = executor.submit(read, periods[i + 1])
+                yield period, result
+
+    def _geometry(self, utc_period, geo_location_criteria):
+        # handles are shared process wide, see netcdf_pool
+        with dataset_pool.dataset(self._filename) as dataset:
+            return self._read_geometry(dataset, utc_period, geo_location_criteria)
+
+    def _read_block(self, geo, input_source_types):
+        with dataset_pool.dataset(self._filename) as dataset:
+            raw_data = self._read_raw(dataset, geo, input_source_types)
+        return self._to_geo_ts(raw_data, geo, input_source_types)
 
     def _get_data_from_dataset(self, dataset, input_source_types, utc_period,
                                geo_location_criteria):
+        geo = self._read_geometry(dataset, utc_period, geo_location_criteria)
+        raw_data = self._read_raw(dataset, geo, input_source_types)
+        return self._to_geo_ts(raw_data, geo, input_source_types)
 
-        x = dataset.variables.get("x", None)
-        y = dataset.variables.get("y", None)
-        time = dataset.variables.get("time", None)
-        dim_nb_series = [dim.name for dim in dataset.dimensions.values() if dim.name != 'time'][0]
-        if not all([x, y, time]):
-            raise CFDataRepositoryError("Something is wrong with the dataset."
-                                        " x/y coords or time not found.")
-        time = convert_netcdf_time(time.units, time)
-        data_cs = dataset.variables.get("crs", None)
-        if data_cs is None:
-            raise CFDataRepositoryError("No coordinate system information in dataset.")
+    def _read_geometry(self, dataset, utc_period, geo_location_criteria):
+        """
+        Decode time and station coordinates of dataset and find the time slice and
+        spatial subset covering utc_period and geo_location_criteria.
+        """
+        with NETCDF_LOCK:
+            x = dataset.variables.get("x", None)
+            y = dataset.variables.get("y", None)
+            time = dataset.variables.get("time", None)
+            dim_nb_series = [dim.name for dim in dataset.dimensions.values() if dim.name != 'time'][0]
+            if not all([x, y, time]):
+                raise CFDataRepositoryError("Something is wrong with the dataset."
+                                            " x/y coords or time not found.")
+            filepath = dataset.filepath()
+            # decoded once per file; dt is set when the spacing is uniform
+            time, dt = time_axis_cache.get(filepath, time)
+            data_cs = dataset.variables.get("crs", None)
+            if data_cs is None:
+                raise CFDataRepositoryError("No coordinate system information in dataset.")
+            data_proj = data_cs.proj
 
-        time_slice, issubset = _make_time_slice(time, utc_period, CFDataRepositoryError)
+        time_slice, issubset = make_time_slice(time, dt, utc_period, CFDataRepositoryError)
 
-        x, y, m_xy, xy_slice = _limit_1D(x[:], y[:], data_cs.proj, self.shyft_cs, geo_location_criteria, 
-                                             self._padding, CFDataRepositoryError)
+        def subset():
+            with NETCDF_LOCK:
+                x_all, y_all = x[:], y[:]
+            return limit_1D(x_all, y_all, data_proj, self.shyft_cs, geo_location_criteria,
+                            self._padding, CFDataRepositoryError)
+
+        # station layout is static, so the projection and mask are memoized per file and criteria
+        subset_key = spatial_subset_cache.make_key(filepath, data_proj, self.shyft_cs,
+                                                   geo_location_criteria, self._padding)
+        x, y, m_xy, xy_slice = spatial_subset_cache.get_or_compute(subset_key, subset,
+                                                                   cache_dir=self._subset_cache_dir)
 
-        raw_data = {}
-        for k in dataset.variables.keys():
-            if self._nc_shyft_map.get(k, None) in input_source_types:
-                if k in self._shift_fields and issubset:  # Add one to time slice
-                    data_time_slice = slice(time_slice.start, time_slice.stop + 1)
-                else:
-                    data_time_slice = time_slice
-                data = dataset.variables[k]
-                pure_arr = _slice_var_1D(data, dim_nb_series, xy_slice, m_xy, slices={'time': data_time_slice})
-                raw_data[self._nc_shyft_map[k]] = pure_arr, k
         if "z" in dataset.variables.keys():
             data = dataset.variables["z"]
             # dims = data.dimensions
             # data_slice = len(data.dimensions)*[slice(None)]
             # data_slice[dims.index("dim_nb_series")] = m_xy
             # z = data[data_slice]
-            z = data[m_xy]
+            with NETCDF_LOCK:
+                z = data[m_xy]
         else:
             raise CFDataRepositoryError("No elevations found in dataset")
 
+        return {"x": x, "y": y, "z": z, "m_xy": m_xy, "xy_slice": xy_slice,
+                "dim_nb_series": dim_nb_series, "time": time, "dt": dt,
+                "time_slice": time_slice, "issubset": issubset}
+
+    def _read_raw(self, dataset, geo, input_source_types):
+        """
+        Read the requested variables of dataset within the subset found by _read_geometry.
+        """
+        time_slice = geo["time_slice"]
+        raw_data = {}
+        for k in dataset.variables.keys():
+            if self._nc_shyft_map.get(k, None) in input_source_types:
+                if k in self._shift_fields and geo["issubset"]:  # Add one to time slice
+                    data_time_slice = slice(time_slice.start, time_slice.stop + 1)
+                else:
+                    data_time_slice = time_slice
+                data = dataset.variables[k]
+                pure_arr = _read_var_1D(data, geo["dim_nb_series"], geo["xy_slice"], geo["m_xy"],
+                                        data_time_slice, self._dtype)
+                raw_data[self._nc_shyft_map[k]] = pure_arr, k
+        return raw_data
+
+    def _to_geo_ts(self, raw_data, geo, input_source_types):
         # Make sure requested fields are valid, and that dataset contains the requested data.
         if not self.allow_subset and not (set(raw_data.keys()).issuperset(input_source_types)):
             raise CFDataRepositoryError("Could not find all data fields")
 
-        extracted_data = self._transform_raw(raw_data, time[time_slice], issubset=issubset)
-        return _numpy_to_geo_ts_vec(extracted_data, x, y, z, CFDataRepositoryError)
-    
-    def _transform_raw(self, data, time, issubset=False):
+        extracted_data = self._transform_raw(raw_data, geo["time"][geo["time_slice"]], issubset=geo["issubset"],
+                                             dt=geo["dt"])
+        return _numpy_to_geo_ts_vec(extracted_data, geo["x"], geo["y"], geo["z"], CFDataRepositoryError)
+
+    def _transform_raw(self, data, time, issubset=False, dt=None):
         """
         We need full time if deaccumulating
+
+        Conversions work in place on the freshly read buffers and return views.
+        With a fixed step dt the time axes are created as fixed-dt TimeAxis.
         """
 
         def noop_time(t):
-            return TimeAxis(UtcTimeVector.from_numpy(t.astype(int)), int(2*t[-1] - t[-2]))
+            return make_time_axis(t, dt, end=int(2*t[-1] - t[-2]))
 
         def dacc_time(t):
-            return noop_time(t) if issubset else TimeAxis(UtcTimeVector.from_numpy(t.astype(int)))
+            return noop_time(t) if issubset else make_time_axis(t, dt)
 
         def noop_space(x):
             return x
 
         def air_temp_conv(T):
-            return T - 273.15
+            T -= 273.15
+            return T
 
         def prec_conv(p):
             return p[1:]
 
         def prec_acc_conv(p):
-            return np.clip(p[1:] - p[:-1], 0.0, 1000.0)
+            dp = _diff_in_place(p)
+            return np.clip(dp, 0.0, 1000.0, out=dp)
         
         def rad_conv(r):
-            dr = r[1:] - r[:-1]
-            return np.clip(dr/(time[1] - time[0]), 0.0, 5000.0)
+            dr = _diff_in_place(r)
+            dr /= (time[1] - time[0])
+            return np.clip(dr, 0.0, 5000.0, out=dr)
 
         # Unit- and aggregation-dependent conversions go here
         convert_map = {"wind_speed": lambda x, t: (noop_space(x), noop_time(t)),
@@ -139,4 +421,61 @@ class CFDataRepos(interfaces.GeoTsRepository):
         res = {}
         for k, (v, ak) in data.items():
             res[k] = convert_map[ak](v, time)
-        return res
\ No newline at end of file
+        return res
+
+
+class CFMultiDataRepos(CFDataRepos):
+    """
+    Repository for geo located timeseries stored in a set of netCDF files sharing
+    one station layout, e.g. the per-variable WFDE5 files written by
+    raw_data_to_shyft_input.ipynb.
+
+    Time, coordinates and the spatial subset are decoded once from the first file,
+    and the variable payloads of all files are then read and converted in parallel
+    into one combined geo_ts result.
+    """
+
+    def __init__(self, epsg, filenames, padding=5000., max_workers=None, subset_cache_dir=None, dtype="float64",
+                 prefetch=False, prefetch_memory_mb=1024.):
+        if not filenames:
+            raise CFDataRepositoryError("At least one filename is required")
+        super().__init__(epsg, filenames[0], padding=padding, subset_cache_dir=subset_cache_dir, dtype=dtype,
+                         prefetch=prefetch, prefetch_memory_mb=prefetch_memory_mb)
+        self._filenames = [_resolve_filename(f) for f in filenames]
+        self._max_workers = max_workers or len(self._filenames)
+
+    def _geometry(self, utc_period, geo_location_criteria):
+        with dataset_pool.dataset(self._filenames[0]) as dataset:
+            geo = self._read_geometry(dataset, utc_period, geo_location_criteria)
+            with NETCDF_LOCK:
+                geo["n_series"] = len(dataset.dimensions[geo["dim_nb_series"]])
+        return geo
+
+    def _read_block(self, geo, input_source_types):
+        n_time = len(geo["time"])
+
+        def read(filename):
+            with dataset_pool.dataset(filename) as dataset:
+                with NETCDF_LOCK:
+                    same_layout = geo["dim_nb_series"] in dataset.dimensions and \
+                        len(dataset.dimensions[geo["dim_nb_series"]]) == geo["n_series"] and \
+                        len(dataset.dimensions["time"]) == n_time
+                if not same_layout:
+                    raise CFDataRepositoryError("Station layout of '{}' differs from '{}'".format(
+                        filename, self._filenames[0]))
+                raw_data = self._read_raw(dataset, geo, input_source_types)
+            # conversion runs after the handle is released, overlapping with the other reads
+            return raw_data, self._transform_raw(raw_data, geo["time"][geo["time_slice"]],
+                                                 issubset=geo["issubset"], dt=geo["dt"])
+
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            results = list(executor.map(read, self._filenames))
+
+        found = set()
+        extracted_data = {}
+        for raw_data, converted in results:
+            found.update(raw_data.keys())
+            extracted_data.update(converted)
+        if not self.allow_subset and not found.issuperset(input_source_types):
+            raise CFDataRepositoryError("Could not find all data fields")
+        return _numpy_to_geo_ts_vec(extracted_data, geo["x"], geo["y"], geo["z"], CFDataRepositoryError)
@@ -4,22 +4,31 @@ from builtins import range
 from os import path
 
 import numpy as np
-from netCDF4 import Dataset
-import xarray as xr
 
 from shyft.time_series import (TimeAxisFixedDeltaT,TsFactory,DoubleVector)
 from shyft.hydrology import shyftdata_dir
-from shyft.hydrology.repository.netcdf.time_conversion import convert_netcdf_time
 from shyft.hydrology.repository import interfaces
+from mst_himalaya.cache_utils import LRUCache
+from mst_himalaya.netcdf_pool import NETCDF_LOCK, dataset_pool
+from mst_himalaya.time_axis_cache import time_axis_cache
 
 
 class CFTsRepositoryError(Exception):
     pass
 
+
+# (filename, mtime) -> (series ids, series id -> index, series dimension name), shared by all repository
+# instances, bounded as every rewrite of a file adds a key
+_series_tables = LRUCache(64)
+
+
 class CFTsRepository(interfaces.TsRepository):
     """
     Repository for geo located timeseries stored in netCDF files.
 
+    The file is opened once through the shared dataset pool, the series-id table and
+    decoded time vector are cached, and each read only touches the requested
+    (time slice, series) block of the data variable.
     """
 
     def __init__(self, file, var_type):
@@ -41,6 +50,11 @@ class CFTsRepository(interfaces.TsRepository):
 
         self._filename = filename  # path.join(directory, filename)
 
+    @property
+    def filenames(self):
+        """Files the series are read from."""
+        return [self._filename]
+
     def read(self, list_of_ts_id, period):
         if not period.valid():
             raise CFTsRepositoryError("period should be valid()  of type UtcPeriod")
@@ -49,10 +63,9 @@ class CFTsRepository(interfaces.TsRepository):
 
         if not path.isfile(filename):
             raise CFTsRepositoryError("File '{}' not found".format(filename))
-        dataset = xr.open_mfdataset(filename, decode_times = False)
-        return self._get_data_from_dataset(dataset, period, list_of_ts_id)
-#         with Dataset(filename) as dataset:
-#             return self._get_data_from_dataset(dataset, period, list_of_ts_id)
+        with dataset_pool.dataset(filename) as dataset:
+            return self._get_data_from_dataset(dataset, period, list_of_ts_id)
+
     def _convert_to_timeseries(self, data, t, ts_id):
         ta = TimeAxisFixedDeltaT(int(t[0]), int(t[1]) - int(t[0]), len(t))
         tsc = TsFactory().create_point_ts
@@ -64,36 +77,54 @@ class CFTsRepository(interfaces.TsRepository):
         ts = [construct(data[:, j]) for j in range(data.shape[-1])]
         return {k: v for k, v in zip(ts_id, ts)}
 
+    def _series_table(self, dataset):
+        key = path.abspath(self._filename), path.getmtime(self._filename)
+
+        def build():
+            if 'series_name' not in dataset.variables:
+                raise CFTsRepositoryError("No series_name variable in '{}'".format(self._filename))
+            dim_nb_series = [dim for dim in dataset.dimensions if dim != 'time'][0]
+            with NETCDF_LOCK:
+                ts_id_in_file = np.array(list(dataset.variables['series_name'][:]))
+            index = {ts_id: i for i, ts_id in enumerate(ts_id_in_file.tolist())}
+            return ts_id_in_file, index, dim_nb_series
+
+        return _series_tables.get_or_compute(key, build)
+
     def _get_data_from_dataset(self, dataset, utc_period, ts_id_to_extract):
 
-        ts_id_key = 'series_name'
-        ts_id_in_file = np.array(list(dataset['series_name'].values))
-        time = dataset.time
-        data = dataset[self.var_name]
-        dim_nb_series = []
-        for i in dataset.dims:
-            if i != 'time':
-                dim_nb_series.append(i)
-        if (len(data.values) or len(time.values)) == 0:
-            print("Something is wrong with the dataset."
-                                      " hydroclim variable or time not found.")
-        time = convert_netcdf_time(time.units, time)
+        ts_id_in_file, index, dim_nb_series = self._series_table(dataset)
+        time = dataset.variables.get("time", None)
+        data = dataset.variables.get(self.var_name, None)
+        with NETCDF_LOCK:
+            if data is None or time is None or data.size == 0 or time.size == 0:
+                raise CFTsRepositoryError("Something is wrong with the dataset."
+                                          " hydroclim variable or time not found.")
+            time, _ = time_axis_cache.get(self._filename, time)
+            dims = data.dimensions
         idx_min = np.searchsorted(time, utc_period.start, side='left')
+        if idx_min == len(time):
+            raise CFTsRepositoryError("No data in '{}' after the start of the requested period".format(self._filename))
         if time[idx_min] > utc_period.start and idx_min > 0:  # important ! ensure data *cover* the the requested period, Shyft ts do take care of resolution etc.
             idx_min -= 1  # extend range downward so we cover the entire requested period
         idx_max = np.searchsorted(time, utc_period.end, side='right') - 1
         if time[idx_max] < utc_period.end and idx_max + 1 < len(time):
             idx_max += 1  # extend range upward so that we cover the requested period
 
-        issubset = True if idx_max < len(time) - 1 else False
-        time_slice = slice(idx_min, idx_max)
-        mask = np.array([idx in ts_id_to_extract for idx in ts_id_in_file])
-        dims = data.dims
-        series_indxs = []
-        for i, name in enumerate(dataset.series_name.values):
-            if name in ts_id_to_extract:
-                series_indxs.append(i)
-        extracted_data = data.sel(series = series_indxs, time = time_slice)
-        #     if isinstance(extracted_data, np.ma.core.MaskedArray):
-    #         extracted_data = extracted_data.filled(np.nan)
-        return self._convert_to_timeseries(extracted_data, time.sel(time = time_slice), ts_id_in_file[mask])
+        # idx_max is inclusive, as with the label based selection this repository used to do
+        time_slice = slice(idx_min, idx_max + 1)
+        # sorted and unique, as netCDF4 orthogonal indexing expects
+        series_indxs = np.unique(np.fromiter((index[ts_id] for ts_id in ts_id_to_extract if ts_id in index),
+                                             dtype=np.int64))
+        if len(series_indxs) == 0:
+            return {}
+        data_slice = len(dims)*[slice(None)]
+        data_slice[dims.index("time")] = time_slice
+        data_slice[dims.index(dim_nb_series)] = series_indxs
+        with NETCDF_LOCK:
+            extracted_data = data[tuple(data_slice)]
+        if isinstance(extracted_data, np.ma.core.MaskedArray):
+            extracted_data = extracted_data.filled(np.nan)
+        if dims.index("time") != 0:
+            extracted_data = extracted_data.T
+        return self._convert_to_timeseries(extracted_data, time[time_slice], ts_id_in_file[series_indxs])
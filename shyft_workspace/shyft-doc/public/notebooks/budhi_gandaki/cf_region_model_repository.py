@@ -12,6 +12,7 @@ from shyft.hydrology.orchestration.configuration.config_interfaces import Region
 from shyft.hydrology.orchestration.configuration.dict_configs import DictModelConfig, DictRegionConfig
 from shyft.hydrology.repository.netcdf.utils import create_ncfile, make_proj, make_transform
 from shyft.hydrology import shyftdata_dir
+from mst_himalaya.parameter_template import parameter_template
 
 class CFRegionModelRepositoryError(Exception):
     pass
@@ -163,17 +164,8 @@ class CFRegionModelRepository(interfaces.RegionModelRepository):
             gf = Vars["glacier-fraction"][mask]
 
         # Construct region parameter:
-        region_parameter = self._region_model.parameter_t()
-        for p_type_name, value_ in self._mconf.model_parameters().items():
-            if hasattr(region_parameter, p_type_name):
-                sub_param = getattr(region_parameter, p_type_name)
-                for p, v in value_.items():
-                    if hasattr(sub_param, p):
-                        setattr(sub_param, p, v)
-                    else:
-                        raise RegionConfigError("Invalid parameter '{}' for parameter set '{}'".format(p, p_type_name))
-            else:
-                raise RegionConfigError("Invalid parameter set '{}' for selected model '{}'".format(p_type_name, self._region_model.__name__))
+        template = parameter_template(self._region_model)
+        region_parameter = template.create(self._mconf.model_parameters())
 
         radiation_slope_factor = 0.9  # TODO: Move into yaml file similar to p_corr_scale_factor
         unknown_fraction = 1.0 - gf - lf - rf - ff
@@ -186,21 +178,10 @@ class CFRegionModelRepository(interfaces.RegionModelRepository):
             c.geo.epsg_id = int(self._epsg)
         # Construct catchment overrides
         catchment_parameters = self._region_model.parameter_t.map_t()
+        region_values = template.values(region_parameter)
         for cid, catch_param in self._rconf.parameter_overrides().items():
             if cid in c_ids_unique:
-                param = self._region_model.parameter_t(region_parameter)
-                for p_type_name, value_ in catch_param.items():
-                    if hasattr(param, p_type_name):
-                        sub_param = getattr(param, p_type_name)
-                        for p, v in value_.items():
-                            if hasattr(sub_param, p):
-                                setattr(sub_param, p, v)
-                            else:
-                                raise RegionConfigError("Invalid parameter '{}' for catchment parameter set '{}'".format(p, p_type_name))
-                    else:
-                        raise RegionConfigError("Invalid catchment parameter set '{}' for selected model '{}'".format(p_type_name, self._region_model.__name__))
-
-                catchment_parameters[cid] = param
+                catchment_parameters[cid] = template.create(catch_param, region_parameter, region_values, catchment=True)
         region_model = self._region_model(cell_vector, region_parameter, catchment_parameters)
         region_model.bounding_region = bounding_region
         region_model.catchment_id_map = c_ids_unique